@@ -0,0 +1,146 @@
+"""
+Date: 17.10.2026
+Description: Benchmark of trial rejection and latency methods on synthetic MEPs (see synthetic.py): throughput, time per
+stage, peak memory and accuracy against the known MEP onsets, at several numbers of trials. Results can be saved as json
+and compared with a previous run to catch performance regressions.
+"""
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+import numpy as np
+
+import preprocessing as pp
+import synthetic
+from epoch_c import EpochBatch
+
+# Trigger time and trial duration of the synthetic recordings: only the span used by the methods is generated
+T_TIME = 0.25
+DURATION = 0.35
+METHODS = ['latency_bigoni_method', 'latency_method_hamada_1', 'latency_method_hamada_2',
+           'latency_method_garvey_revised', 'latency_method_huang', 'latency_method_daskalakis']
+
+
+def run_benchmark(num_trials, trials_per_subject=100, fs=5000, seed=0, dtype='float64'):
+    """Run rejection and all latency methods on num_trials synthetic trials, subject by subject, processed with dtype.
+    Time and memory are measured in separate passes over the same trials, so that tracing the allocations does not
+    slow down the timed one
+    :return report: dict with trials_per_s, time (s) of each stage, peak_mb (peak memory allocated while processing a
+    subject, without the generation of its trials) and accuracy (mae in samples and detection_rate of each method, on
+    the kept trials)
+    """
+    num_subjects = max(1, num_trials // trials_per_subject)
+    cohort = dict(num_subjects=num_subjects, seed=seed, num_trials=trials_per_subject, fs=fs, t_time=T_TIME,
+                  duration=DURATION)
+    times = defaultdict(float)
+    latencies, onsets = defaultdict(list), []
+    for sub_id, epochs_emg, sub_onsets in synthetic.generate_cohort(**cohort):
+        keep, sub_latencies = _process_subject(epochs_emg.astype(dtype, copy=False), fs, times)
+        for method in METHODS:
+            latencies[method].append(sub_latencies[method][keep])
+        onsets.append(sub_onsets[keep])
+
+    peak = 0
+    tracemalloc.start()
+    for sub_id, epochs_emg, _ in synthetic.generate_cohort(**cohort):
+        epochs_emg = epochs_emg.astype(dtype, copy=False)
+        tracemalloc.reset_peak()
+        current, _ = tracemalloc.get_traced_memory()
+        _process_subject(epochs_emg, fs)
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - current)
+        del epochs_emg
+    tracemalloc.stop()
+
+    onsets = np.concatenate(onsets)
+    has_mep = ~np.isnan(onsets)
+    accuracy = {}
+    for method in METHODS:
+        lat = np.concatenate(latencies[method])[has_mep]
+        detected = ~np.isnan(lat)
+        accuracy[method] = {'mae': float(np.mean(abs(lat[detected] - onsets[has_mep][detected]))) if detected.any()
+                            else float('nan'),
+                            'detection_rate': float(np.mean(detected)) if len(lat) else float('nan')}
+
+    return {'num_trials': num_subjects * trials_per_subject, 'dtype': np.dtype(dtype).name,
+            'trials_per_s': num_subjects * trials_per_subject / sum(times.values()),
+            'time': dict(times), 'peak_mb': peak / 2**20, 'accuracy': accuracy}
+
+
+def _process_subject(epochs_emg, fs, times=None):
+    """Rejection and all latency methods on the trials of a subject
+    :param times: defaultdict(float) to which the time (s) of each stage is added, None not to time them
+    :return keep: boolean array of the kept trials
+    :return latencies: dict, array of latencies of each method"""
+    times = times if times is not None else defaultdict(float)
+    t_start = time.perf_counter()
+    epochs_mep = pp.divide_in_epochs(epochs_emg, fs, T_TIME, 0.01, 0.05)
+    epochs_baseline = pp.divide_in_epochs(epochs_emg, fs, T_TIME, -0.025, -0.005)
+    keep, _ = pp.reject_trials(epochs_mep, epochs_baseline)
+    times['rejection'] += time.perf_counter() - t_start
+
+    t_start = time.perf_counter()
+    epochs = EpochBatch(epochs_mep, epochs_emg, fs, T_TIME, keep=keep)
+    times['baseline_stats'] += time.perf_counter() - t_start
+    latencies = {}
+    for method in METHODS:
+        t_start = time.perf_counter()
+        latencies[method] = getattr(epochs, method)()
+        times[method] += time.perf_counter() - t_start
+
+    return keep, latencies
+
+
+def compare_reports(reports, previous_reports, tolerance=0.2):
+    """Find the stages that got slower than in a previous benchmark by more than tolerance (relative)
+    :return regressions: list of messages"""
+    regressions = []
+    for scale, report in reports.items():
+        if scale not in previous_reports:
+            continue
+        for stage, t in report['time'].items():
+            t_previous = previous_reports[scale]['time'].get(stage)
+            if t_previous and t > t_previous * (1 + tolerance):
+                regressions.append(f'{scale} trials - {stage}: {t:.4f} s (was {t_previous:.4f} s)')
+
+    return regressions
+
+
+def print_report(report):
+    print(f'{report["num_trials"]} trials ({report["dtype"]}): {report["trials_per_s"]:.0f} trials/s, peak memory '
+          f'{report["peak_mb"]:.1f} MB')
+    for stage, t in report['time'].items():
+        accuracy = report['accuracy'].get(stage)
+        accuracy = f'\tmae {accuracy["mae"]:.2f} samples, detected {100 * accuracy["detection_rate"]:.1f}%' \
+            if accuracy else ''
+        print(f'\t{stage:<32}{t:.4f} s{accuracy}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark MEP rejection and latency methods on synthetic data')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1000, 10000, 100000, 1000000],
+                        help='numbers of trials to benchmark')
+    parser.add_argument('--trials-per-subject', type=int, default=100)
+    parser.add_argument('--fs', type=int, default=5000, help='sampling frequency (Hz)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--dtype', default='float64', choices=['float64', 'float32'], help='dtype of the processing')
+    parser.add_argument('--json', help='save results to this json file')
+    parser.add_argument('--compare', help='json file of a previous benchmark, exit with error if slower')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='relative slow-down accepted by --compare')
+    args = parser.parse_args()
+
+    reports = {}
+    for scale in args.scales:
+        reports[str(scale)] = run_benchmark(scale, args.trials_per_subject, args.fs, args.seed, args.dtype)
+        print_report(reports[str(scale)])
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(reports, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare_reports(reports, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f'Regression - {regression}')
+        if regressions:
+            sys.exit(1)
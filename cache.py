@@ -0,0 +1,155 @@
+"""
+Date: 17.10.2026
+Description: Disk cache of the results of each subject, so that re-running main.py only processes new or modified
+recordings. Entries are addressed by the hash of the recording, the parameters of the processing and METHOD_VERSION.
+Files are written to a temporary file and renamed, so that several processes can share the cache: a reader sees either
+a complete entry or none. The size of the cache is summed when it is opened and updated by each entry added; the least
+recently used entries are removed when it exceeds the maximum size, and the hashes of recordings that were modified or
+deleted when the cache is opened.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import numpy as np
+
+# Increase when the results of the processing change (e.g., a latency method or the rejection is modified), so that
+# the entries computed before are not used
+METHOD_VERSION = 1
+
+
+class ResultCache:
+    """Cache of arrays (e.g., the latencies of a subject) and json info, one npz file per entry"""
+    def __init__(self, path, max_size_mb=1024):
+        """
+        :param path: folder of the cache (created if needed)
+        :param max_size_mb: size above which the least recently used entries are removed
+        """
+        self.path = path
+        self.max_size = max_size_mb * 2**20
+        os.makedirs(os.path.join(path, 'hashes'), exist_ok=True)
+        self.evict_hashes()
+        # size of the entries (bytes), as far as this instance knows: entries added or removed by other processes are
+        # only counted at the next eviction
+        self.size = sum(entry_size for _, entry_size, _ in self._entries())
+
+    def key(self, file_path, parameters):
+        """Key of the results of a file processed with some parameters
+        :param file_path: path to the input file
+        :param parameters: json serializable parameters of the processing
+        :return str"""
+        key = hashlib.sha256(self.file_hash(file_path).encode())
+        key.update(json.dumps(parameters, sort_keys=True).encode())
+        key.update(str(METHOD_VERSION).encode())
+
+        return key.hexdigest()
+
+    def file_hash(self, file_path):
+        """sha256 of the content of a file. It is stored in the cache for the path, size and modification time of the
+        file, so that unchanged files are not read again"""
+        file_path = os.path.abspath(file_path)
+        stat = os.stat(file_path)
+        stat_key = hashlib.sha256(f'{file_path}:{stat.st_size}:{stat.st_mtime_ns}'.encode())
+        hash_path = os.path.join(self.path, 'hashes', stat_key.hexdigest())
+        try:
+            with open(hash_path) as f:
+                return json.load(f)['hash']
+        except (FileNotFoundError, KeyError, TypeError, ValueError):
+            pass
+
+        file_hash = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(2**24), b''):
+                file_hash.update(chunk)
+        file_hash = file_hash.hexdigest()
+        stored = {'hash': file_hash, 'path': file_path, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        self._write(hash_path, lambda f: f.write(json.dumps(stored).encode()))
+
+        return file_hash
+
+    def get(self, key):
+        """Entry of a key
+        :return (arrays, info) tuple, None if the key is not in the cache"""
+        entry_path = os.path.join(self.path, f'{key}.npz')
+        try:
+            with np.load(entry_path) as entry:
+                arrays = {name: entry[name] for name in entry.files if name != '__info__'}
+                info = json.loads(str(entry['__info__']))
+            os.utime(entry_path)    # most recently used
+        except (FileNotFoundError, KeyError, ValueError, OSError):
+            # missing, removed by another process, or not readable (treated as missing and recomputed)
+            return None
+
+        return arrays, info
+
+    def put(self, key, arrays, info=None):
+        """Add an entry, then remove the least recently used ones if the cache is too large
+        :param key: key of the entry (see key)
+        :param arrays: dict, name -> array
+        :param info: json serializable info"""
+        entry_path = os.path.join(self.path, f'{key}.npz')
+        try:
+            self.size -= os.stat(entry_path).st_size     # replaced entry
+        except FileNotFoundError:
+            pass
+        self._write(entry_path, lambda f: np.savez(f, __info__=json.dumps(info), **arrays))
+        self.size += os.stat(entry_path).st_size
+        if self.size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache is not larger than its maximum size"""
+        entries = self._entries()
+        size = sum(entry_size for _, entry_size, _ in entries)
+        for _, entry_size, entry_path in sorted(entries):
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(entry_path)
+            except FileNotFoundError:   # already removed by another process
+                pass
+            size -= entry_size
+        self.size = size
+
+    def evict_hashes(self):
+        """Remove the stored hashes of the files that were deleted or modified since they were hashed (or that cannot be
+        read), which would never be used again"""
+        for entry in os.scandir(os.path.join(self.path, 'hashes')):
+            if entry.name.endswith('.tmp'):     # being written by another process
+                continue
+            try:
+                with open(entry.path) as f:
+                    stored = json.load(f)
+                stat = os.stat(stored['path'])
+                if (stat.st_size, stat.st_mtime_ns) == (stored['size'], stored['mtime_ns']):
+                    continue
+            except (KeyError, TypeError, ValueError, OSError):   # file deleted, or hash not readable
+                pass
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:   # already removed by another process
+                pass
+
+    def _entries(self):
+        """(modification time, size, path) of each entry of the cache"""
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith('.npz'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:   # removed by another process
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        return entries
+
+    def _write(self, path, write):
+        """Write a file atomically: write(f) writes to a temporary file, which then replaces path"""
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
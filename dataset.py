@@ -0,0 +1,130 @@
+"""
+Date: 17.10.2026
+Description: On-disk format of MEP datasets (e.g., the trials to annotate with the ground truth app). A dataset is a
+folder with:
+- epochs.bin: the epochs of all trials as a single contiguous float array, trials x samples (C order)
+- index.csv: sub_id, trial (index among the trials kept after rejection) and orig_trial (index in the recording) of
+  each row of epochs.bin, and channel for multichannel recordings (trials are then numbered in each channel; -1 for
+  the single-channel recordings of the dataset)
+- info.json: sampling frequency, trigger time, samples of the epochs and dtype
+Datasets are opened with memory mapping, so opening does not depend on the size of the dataset. Convert a dataframe
+saved by the previous version of create_dataframe.py with: python dataset.py df_meps.pkl output_folder
+"""
+import json
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+import preprocessing as pp
+
+MEP_WINDOW = (0.01, 0.05)   # MEP window (related to the trigger, in s), as in main.py
+
+
+class DatasetWriter:
+    """Write a dataset subject by subject. Use as a context manager, or call close() at the end."""
+    def __init__(self, path, fs, t_time=1, sample_offset=0, dtype='float64'):
+        """
+        :param path: folder of the dataset (created if needed)
+        :param fs: sampling frequency (Hz)
+        :param t_time: time of trigger in the recordings
+        :param sample_offset: index in the recordings of the first sample of the epochs
+        :param dtype: dtype of the saved epochs
+        """
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.info = {'fs': fs, 't_time': t_time, 'sample_offset': sample_offset, 'num_samples': None,
+                     'dtype': np.dtype(dtype).str}
+        self.index = []
+        self._file = open(os.path.join(path, 'epochs.bin'), 'wb')
+
+    def append(self, sub_id, epochs, orig_trials=None, trials=None, channels=None):
+        """Add the trials of a subject
+        :param sub_id: subject id
+        :param epochs: MxN array, M samples, N trials
+        :param orig_trials: index in the recording of each trial (default: same as trials)
+        :param trials: index of each trial among the kept ones (default: 0 to N-1)
+        :param channels: channel of each trial, for multichannel recordings"""
+        num_samples, num_trials = epochs.shape
+        if self.info['num_samples'] is None:
+            self.info['num_samples'] = num_samples
+        elif num_samples != self.info['num_samples']:
+            raise ValueError(f'Epochs of {sub_id} have {num_samples} samples instead of {self.info["num_samples"]}')
+        np.ascontiguousarray(epochs.T, dtype=self.info['dtype']).tofile(self._file)
+        trials = np.arange(num_trials) if trials is None else trials
+        index = pd.DataFrame({'sub_id': sub_id, 'trial': trials,
+                              'orig_trial': trials if orig_trials is None else orig_trials})
+        if channels is not None:
+            index['channel'] = channels
+        self.index.append(index)
+
+    def close(self):
+        self._file.close()
+        index = pd.concat(self.index) if self.index else pd.DataFrame(columns=['sub_id', 'trial', 'orig_trial'])
+        if 'channel' in index:
+            index['channel'] = index['channel'].fillna(-1).astype(int)
+        index.to_csv(os.path.join(self.path, 'index.csv'), index=False)
+        with open(os.path.join(self.path, 'info.json'), 'w') as f:
+            json.dump(self.info, f, indent=2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class MEPDataset:
+    """Dataset opened with memory mapping: epochs are read from disk only when accessed."""
+    def __init__(self, path):
+        with open(os.path.join(path, 'info.json')) as f:
+            info = json.load(f)
+        self.path = path
+        self.fs = info['fs']
+        self.t_time = info['t_time']
+        self.sample_offset = info['sample_offset']
+        self.index = pd.read_csv(os.path.join(path, 'index.csv'), dtype={'sub_id': str})
+        if len(self.index):
+            self.epochs = np.memmap(os.path.join(path, 'epochs.bin'), dtype=info['dtype'], mode='r',
+                                    shape=(len(self.index), info['num_samples']))
+        else:
+            self.epochs = np.zeros((0, info['num_samples'] or 0), dtype=info['dtype'])
+        self._mep_start, self._mep_stop = pp.epoch_samples(self.fs, self.t_time, *MEP_WINDOW)
+
+    def __len__(self):
+        return len(self.index)
+
+    def mep(self, row):
+        """MEP window of a trial
+        :param row: row of the trial in the dataset
+        :return 1D array"""
+        return self.epochs[row, self._mep_start - self.sample_offset:self._mep_stop - self.sample_offset]
+
+    def subject_rows(self):
+        """Rows of the trials of each subject
+        :return dict sub_id -> array of rows"""
+        return {sub_id: rows.values for sub_id, rows in self.index.groupby('sub_id', sort=False).groups.items()}
+
+    def contains(self, t_min, t_max):
+        """True if the epochs include the window between t_min and t_max (related to the trigger)"""
+        samp_t_min, samp_t_max = pp.epoch_samples(self.fs, self.t_time, t_min, t_max)
+
+        return samp_t_min >= self.sample_offset and samp_t_max <= self.sample_offset + self.epochs.shape[1]
+
+
+def convert_pickle(pkl_path, path, fs=5000):
+    """Convert a dataframe of MEPs saved as pickle (columns sub_id, trial and mep, each mep being a list wrapping the
+    array of the MEP window) to a dataset. The original trial indices are not known and are set to -1.
+    :param pkl_path: path to the .pkl file
+    :param path: folder of the new dataset
+    :param fs: sampling frequency (Hz)"""
+    df_meps = pd.read_pickle(pkl_path)
+    samp_t_min, _ = pp.epoch_samples(fs, 1, *MEP_WINDOW)
+    with DatasetWriter(path, fs, 1, samp_t_min) as writer:
+        for sub_id, df_sub in df_meps.groupby('sub_id', sort=False):
+            writer.append(sub_id, np.stack([mep[0] for mep in df_sub['mep']], axis=1), np.full(len(df_sub), -1),
+                          df_sub['trial'].values)
+
+
+if __name__ == '__main__':
+    convert_pickle(sys.argv[1], sys.argv[2])
@@ -3,16 +3,29 @@ Author: Claudia Bigoni
 Date: 23.06.2021
 Description: class Epoch to study MEP features (i.e., peak-to-peak amplitudes and latency)
 """
+from collections import Counter, defaultdict
+from contextlib import nullcontext
 import numpy as np
 import preprocessing as pp
 
+# Pre-stimulus epoch (t_min, t_max related to the trigger, in s) containing the baseline windows of all methods
+BASELINE_EPOCH = (-0.2, -0.002)
+
 
 class Epoch:
-    def __init__(self, input_signal, input_signal_baseline, fs, trigger_sample):
+    def __init__(self, input_signal, input_signal_baseline, fs, trigger_sample, baseline_offset=0,
+                 baseline_stats=None):
         self.v = input_signal
         self.baseline = input_signal_baseline
         self.fs = fs
         self.trigger = trigger_sample
+        self.baseline_offset = baseline_offset  # index in the recording of the first sample of the baseline signal
+        # statistics of the pre-stimulus windows used by the methods (pp.BaselineStats), computed once
+        if baseline_stats is None:
+            baseline_stats = baseline_statistics(input_signal_baseline, fs, trigger_sample, baseline_offset)
+        self.baseline_stats = baseline_stats
+        # number of failures of each latency method (i.e., 'nan' latency) by reason
+        self.failures = defaultdict(Counter)
 
         self.ptp = self.peak_to_peak_amplitude()
 
@@ -31,33 +44,19 @@ class Epoch:
             self.v = -self.v
             p_peak = np.argmax(self.v)
             n_peak = np.argmin(self.v)
-        # Compute first derivative over samples - look until the positive peak only 
+        # Compute first derivative over samples - look until the positive peak only
         # The derivative is approximated as the difference between consecutive samples
         first_derv = np.diff(self.v[:p_peak])
-        # Only interested in positive derivative
-        idx_positive = np.argwhere(first_derv > 0).flatten()
-        # Consider only consecutive samples where derivative is positive
-        idx_positive_diff = np.where(np.diff(idx_positive) == 1)[0]
-        idx_positive_diff_diff = np.where(np.diff(idx_positive_diff) == 1)[0]
-        # Take all chunks of at least 2 consecutive samples having positive derivatives
-        chunks = np.split(idx_positive_diff_diff,
-                          (np.add(np.where(np.diff(idx_positive_diff_diff) > 1), 1)).tolist()[0])
-        # Find the longest chunk in splits
-        max_len = min_len
-        for c in chunks:
-            if len(c) > max_len:
-                max_len = len(c)
-                c_longest = c
+        # Find the longest chunk of consecutive samples having positive derivatives; chunks are counted as in the
+        # first implementation of the method, whose chunk of a run of L positive derivatives had L-2 samples
+        run_start, run_len = pp.longest_runs(first_derv > 0)
 
         # latency is the beginning of the longest array of samples with positive derivatives
-        try:
-            latency = idx_positive[idx_positive_diff[c_longest[0]]]
-        except NameError:
-            latency = 'nan'
-            print('Bigoni method - There is no long enough chunk of positive derivatives')
-        except IndexError:
+        if run_len - 2 > min_len:
+            latency = run_start
+        else:
             latency = 'nan'
-            print('Bigoni method - did not find the beginning of MEP')
+            self.failures['lat_bigoni']['short_positive_chunk' if run_len else 'no_positive_derivative'] += 1
 
         return latency
 
@@ -69,33 +68,31 @@ class Epoch:
             latency = np.where(abs(self.v) > thr)[0][0]
         except IndexError:
             latency = 'nan'
-            print('Hameda method 1 - did not find the beginning of MEP')
+            self.failures['lat_hamada1']['no_threshold_crossing'] += 1
 
         return latency
 
     def latency_method_hamada_2(self):
         # Latency is time point at which rectified EMG signal exceeds an amplitude threshold defined as the average
         # 100 ms pre-stimulus EMG activity plus two SDs"""
-        baseline_100 = pp.divide_in_epochs(self.baseline, self.fs, self.trigger, -0.1, -0.002)
-        thr = np.mean(baseline_100) + 2 * np.std(baseline_100)
+        thr = self.baseline_stats.mean(-0.1, -0.002) + 2 * self.baseline_stats.std(-0.1, -0.002)
         try:
             latency = np.where(abs(self.v) > thr)[0][0]
         except IndexError:
             latency = 'nan'
-            print('Hameda method 2 - did not find the beginning of MEP')
+            self.failures['lat_hamada2']['no_threshold_crossing'] += 1
 
         return latency
 
     def latency_method_huang(self):
         # Latency is time point at which the EMG signal exceeds by more than 5 times the standard deviation the EMG
         # signal measured during the pre-stimulus interval (-200 to 0 ms before the onset of the TMS pulse)"""
-        baseline_200 = pp.divide_in_epochs(self.baseline, self.fs, self.trigger, -0.2, -0.002)
-        thr = 5 * np.std(baseline_200)
+        thr = 5 * self.baseline_stats.std(-0.2, -0.002)
         try:
             latency = np.where(self.v > thr)[0][0]
         except IndexError:
             latency = 'nan'
-            print('Huang method - did not find the beginning of MEP')
+            self.failures['lat_huang']['no_threshold_crossing'] += 1
 
         return latency
 
@@ -104,11 +101,10 @@ class Epoch:
         # mean consecutive difference (MCD), which describes the variation of the pre-stimulus EMG (i.e. 100ms before
         # pulse). Boundaries are EMG +- MCDx2.66. MEP onset is defined as "the first consecutive data points to fall
         # below the lower variation limit". Here we should also do above
-        baseline_100 = np.abs(pp.divide_in_epochs(self.baseline, self.fs, self.trigger, -0.1, -0.002))
-        mean_baseline = np.mean(baseline_100)
-        mcd = np.mean(np.abs(np.diff(baseline_100)))
-        thr_low = np.mean(baseline_100) - 2.66*mcd
-        # thr_high = np.mean(baseline_100) + 2.66*mcd
+        mean_baseline = self.baseline_stats.rectified_mean(-0.1, -0.002)
+        mcd = self.baseline_stats.rectified_mcd(-0.1, -0.002)
+        thr_low = mean_baseline - 2.66*mcd
+        # thr_high = mean_baseline + 2.66*mcd
 
         idx_low = np.where(self.v <= thr_low)[0]
         # idx_high = np.where(self.v >= thr_high)[0]
@@ -120,15 +116,14 @@ class Epoch:
             latency = chunks_low[0][0]
         except IndexError:
             latency = 'nan'
-            print('Garvey method - did not find the beginning of MEP')
+            self.failures['lat_garvey']['no_threshold_crossing'] += 1
 
         return latency
 
     def latency_method_daskalakis(self):
         # The MEP onset was defined as the last crossing of the mean pre-stimulus EMG level before the point of maximum
         # deflection. Pre-stimulus window: 40ms
-        baseline_40 = pp.divide_in_epochs(self.baseline, self.fs, self.trigger, -0.04, -0.002)
-        thr = np.mean(baseline_40)
+        thr = baseline_mean(self.baseline, self.fs, self.trigger, -0.04, -0.002, self.baseline_offset)
         p_peak = np.argmax(self.v)
         n_peak = np.argmin(self.v)
         # If negative deflection is before positive one, flip the signal
@@ -140,10 +135,171 @@ class Epoch:
             latency = np.where(self.v[:p_peak] > thr)[0][-1]
         except IndexError:
             latency = 'nan'
-            print('Daskalakis method - did not find the beginning of MEP')
+            self.failures['lat_daskalakis']['no_crossing_before_peak'] += 1
 
         return latency
 
 
+class EpochBatch:
+    """Batched counterpart of Epoch: the same features computed at once for all the trials of a MxN array (M samples,
+    N trials), or of a MxNxC array (C channels, e.g. muscles, each processed as its own set of trials). Every latency
+    method returns an array with one latency per trial (NxC for several channels; NaN where the beginning of the MEP
+    was not found) equal to what the Epoch method of the same name returns for that trial. As in Epoch, the latency
+    methods that flip the signal (Bigoni and Daskalakis) do so on self.v, which affects the methods called afterwards.
+    """
+    def __init__(self, input_signals, input_signals_baseline, fs, trigger_sample, baseline_offset=0,
+                 baseline_stats=None, keep=None):
+        """
+        :param keep: boolean array (N, or NxC), trials kept by the rejection (see pp.reject_trials). The latency of
+        the other trials is NaN and Hamada method 1 pools the baseline of the kept trials (of each channel) only.
+        Default: all trials
+        """
+        self.v = np.asarray(input_signals)
+        self.keep = keep
+        self.baseline = input_signals_baseline
+        self.fs = fs
+        self.trigger = trigger_sample
+        self.baseline_offset = baseline_offset  # index in the recording of the first sample of the baseline signals
+        if baseline_stats is None:
+            baseline_stats = baseline_statistics(input_signals_baseline, fs, trigger_sample, baseline_offset)
+        self.baseline_stats = baseline_stats
+        # number of trials on which each latency method failed (i.e., NaN latency) by reason
+        self.failures = defaultdict(Counter)
+
+        self.ptp = self.peak_to_peak_amplitude()
+
+    def peak_to_peak_amplitude(self):
+        peak_to_peak = abs(np.max(self.v, axis=0) - np.min(self.v, axis=0))
+
+        return peak_to_peak
+
+    def latency_all_methods(self, baseline_signals=None, stage=None):
+        """Compute the latency of all the trials with every method, in the order used in main.py
+        :param baseline_signals: baseline signals used by Hamada method 1 (see latency_method_hamada_1)
+        :param stage: function returning a context manager run around each method, given its name (e.g.,
+        Instrumentation.stage to time them)
+        :return latencies: dict, one array of N latencies for each method"""
+        stage = stage if stage is not None else (lambda name: nullcontext())
+        methods = {'lat_bigoni': self.latency_bigoni_method,
+                   'lat_hamada1': lambda: self.latency_method_hamada_1(baseline_signals),
+                   'lat_hamada2': self.latency_method_hamada_2,
+                   'lat_garvey': self.latency_method_garvey_revised,
+                   'lat_huang': self.latency_method_huang,
+                   'lat_daskalakis': self.latency_method_daskalakis}
+        latencies = {}
+        for name, method in methods.items():
+            with stage(name):
+                latencies[name] = method()
+
+        return latencies
+
+    def latency_bigoni_method(self, min_len=4):
+        # Same as Epoch.latency_bigoni_method: beginning of the longest run of positive first derivatives before the
+        # positive peak, kept only if its chunk (L-2 samples for a run of L positive derivatives) is longer than min_len
+        p_peak = self._flip_negative_first()
+        first_derv = np.diff(self.v, axis=0)
+        run_start, run_len = pp.longest_runs(first_derv > 0, stop=p_peak - 1)
+        latency = np.where(run_len - 2 > min_len, run_start, np.nan)
+        self._count_failures('lat_bigoni', 'no_positive_derivative', run_len == 0)
+        self._count_failures('lat_bigoni', 'short_positive_chunk', (run_len > 0) & (run_len - 2 <= min_len))
+
+        return self._kept(latency)
+
+    def latency_method_hamada_1(self, baseline_signals=None):
+        # Threshold is the average pre-stimulus EMG activity across all trials plus two SDs. If baseline_signals is
+        # not given, the 200 to 20 ms pre-stimulus EMG of the trials of the batch is used
+        if baseline_signals is None:
+            mean, std = self.baseline_stats.pooled_mean_std(-0.2, -0.02, self.keep)
+        else:
+            mean, std = np.mean(baseline_signals), np.std(baseline_signals)
+        thr = mean + 2 * std
+        latency = _first_crossing(abs(self.v) > thr)
+        self._count_failures('lat_hamada1', 'no_threshold_crossing', np.isnan(latency))
+
+        return self._kept(latency)
+
+    def latency_method_hamada_2(self):
+        # Threshold is the average 100 ms pre-stimulus EMG activity of each trial plus two SDs
+        thr = self.baseline_stats.mean(-0.1, -0.002) + 2 * self.baseline_stats.std(-0.1, -0.002)
+        latency = _first_crossing(abs(self.v) > thr)
+        self._count_failures('lat_hamada2', 'no_threshold_crossing', np.isnan(latency))
+
+        return self._kept(latency)
+
+    def latency_method_huang(self):
+        # Threshold is 5 times the SD of the 200 ms pre-stimulus EMG of each trial
+        thr = 5 * self.baseline_stats.std(-0.2, -0.002)
+        latency = _first_crossing(self.v > thr)
+        self._count_failures('lat_huang', 'no_threshold_crossing', np.isnan(latency))
+
+        return self._kept(latency)
+
+    def latency_method_garvey_revised(self):
+        # Lower variation limit is the mean of the rectified 100 ms pre-stimulus EMG minus 2.66 times its MCD. The
+        # latency is the first sample at or below it
+        mcd = self.baseline_stats.rectified_mcd(-0.1, -0.002)
+        thr_low = self.baseline_stats.rectified_mean(-0.1, -0.002) - 2.66*mcd
+        latency = _first_crossing(self.v <= thr_low)
+        self._count_failures('lat_garvey', 'no_threshold_crossing', np.isnan(latency))
+
+        return self._kept(latency)
+
+    def latency_method_daskalakis(self, t_min=-0.04, t_max=-0.002):
+        # Last crossing of the mean 40 ms pre-stimulus EMG level (or of the window t_min, t_max) before the positive
+        # peak. The crossing compares the samples with the mean itself, so the mean is computed as in Epoch rather than
+        # from the prefix sums
+        thr = baseline_mean(self.baseline, self.fs, self.trigger, t_min, t_max, self.baseline_offset)
+        p_peak = self._flip_negative_first()
+        before_peak = np.arange(self.v.shape[0]).reshape((-1,) + (1,) * (self.v.ndim - 1)) < p_peak
+        latency = _last_crossing((self.v > thr) & before_peak)
+        self._count_failures('lat_daskalakis', 'no_crossing_before_peak', np.isnan(latency))
+
+        return self._kept(latency)
+
+    def _flip_negative_first(self):
+        """Flip the trials whose negative deflection comes before the positive one (as done in Epoch)
+        :return p_peak: array of N samples of the positive peaks, after the flip"""
+        p_peak = np.argmax(self.v, axis=0)
+        n_peak = np.argmin(self.v, axis=0)
+        self.v = np.where(p_peak > n_peak, -self.v, self.v)
+
+        return np.argmax(self.v, axis=0)
+
+    def _kept(self, latency):
+        """Latencies with NaN for the trials not kept"""
+        return latency if self.keep is None else np.where(self.keep, latency, np.nan)
+
+    def _count_failures(self, method, reason, failed):
+        """Add the kept trials where failed is True to the failures of a method"""
+        self.failures[method][reason] += int(np.sum(failed if self.keep is None else failed & self.keep))
+
+
+def baseline_statistics(input_signal_baseline, fs, trigger_sample, baseline_offset=0):
+    """Statistics (pp.BaselineStats) of the pre-stimulus epoch BASELINE_EPOCH of the baseline signal (MxN array, M
+    samples, N trials, MxNxC array, C channels, or 1D array of M samples), used by the latency methods of Epoch and
+    EpochBatch"""
+    baseline = pp.divide_in_epochs(input_signal_baseline, fs, trigger_sample, *BASELINE_EPOCH, baseline_offset)
+    samp_t_min, _ = pp.epoch_samples(fs, trigger_sample, *BASELINE_EPOCH)
+
+    return pp.BaselineStats(baseline, fs, trigger_sample, samp_t_min)
+
+
+def baseline_mean(input_signal_baseline, fs, trigger_sample, t_min, t_max, baseline_offset=0):
+    """Mean of each trial in the epoch between t_min and t_max of the baseline signal (MxN array, M samples, N trials,
+    MxNxC array, or 1D array of M samples). The samples of each trial are summed in the same order as np.mean of that
+    trial alone, so the batched and single-trial means are equal, including when they equal a sample value"""
+    baseline = pp.divide_in_epochs(input_signal_baseline, fs, trigger_sample, t_min, t_max, baseline_offset)
+
+    return np.ascontiguousarray(np.moveaxis(baseline, 0, -1)).mean(axis=-1)
+
+
+def _first_crossing(mask):
+    """First sample (axis 0) where mask is True, NaN for the columns where it never is"""
+    return np.where(mask.any(axis=0), np.argmax(mask, axis=0), np.nan)
+
 
+def _last_crossing(mask):
+    """Last sample (axis 0) where mask is True, NaN for the columns where it never is"""
+    last = mask.shape[0] - 1 - np.argmax(mask[::-1], axis=0)
 
+    return np.where(mask.any(axis=0), last, np.nan)
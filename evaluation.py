@@ -0,0 +1,118 @@
+"""
+Date: 17.10.2026
+Description: Evaluation of the latency methods against the ground truth: mean absolute error, bias, root mean squared
+error, detection rate and Bland-Altman limits of agreement of all methods, per subject and overall, with bootstrap
+confidence intervals. Bootstrap replicates are computed together as weighted sums (number of times each trial is drawn
+times its error), so thousands of replicates take a few matrix products.
+"""
+import numpy as np
+import pandas as pd
+
+METHODS = ['lat_bigoni', 'lat_hamada1', 'lat_hamada2', 'lat_garvey', 'lat_huang', 'lat_daskalakis']
+METRICS = ['mae', 'bias', 'rmse', 'detection_rate', 'loa_low', 'loa_high']
+
+
+def error_metrics(latencies, gt, n_boot=2000, ci=0.95, rng=None, chunk_size=None):
+    """Error metrics of several methods on the same trials. Trials where a method did not find the latency (NaN) count
+    as not detected and are left out of the errors of that method.
+    :param latencies: NxK array, N trials, K methods (samples)
+    :param gt: array of N ground truth latencies (samples), all valid
+    :param n_boot: number of bootstrap replicates (0 for no confidence intervals)
+    :param ci: level of the confidence intervals
+    :param rng: np.random.Generator, or seed
+    :param chunk_size: number of bootstrap replicates computed together. Default: as many as draw about 2 million
+    trials, so that the arrays of a chunk take a few tens of MB whatever the number of trials
+    :return metrics: dict, for each metric a tuple of 3 arrays of K values (estimate, low and high limit of the
+    confidence interval)
+    """
+    rng = np.random.default_rng(rng)
+    num_trials = len(gt)
+    errors = latencies - np.asarray(gt)[:, None]
+    detected = ~np.isnan(errors)
+    errors = np.where(detected, errors, 0)
+    # every weighted sum needed by the metrics, in a single matrix
+    values = np.concatenate([detected, errors, errors**2, abs(errors)], axis=1)
+
+    estimate = _metrics(np.ones(num_trials) @ values, num_trials)
+    if not n_boot or not num_trials:
+        nan = np.full(latencies.shape[1], np.nan)
+        return {metric: (estimate[metric], nan, nan) for metric in METRICS}
+
+    chunk_size = chunk_size if chunk_size is not None else max(1, 2**21 // num_trials)
+    replicates = {metric: [] for metric in METRICS}
+    for start in range(0, n_boot, chunk_size):
+        size = min(chunk_size, n_boot - start)
+        idx = rng.integers(0, num_trials, (size, num_trials))
+        # number of times each trial is drawn in each replicate
+        idx += num_trials * np.arange(size)[:, None]
+        weights = np.bincount(idx.ravel(), minlength=size * num_trials).reshape(size, num_trials)
+        for metric, value in _metrics(weights @ values, num_trials).items():
+            replicates[metric].append(value)
+
+    alpha = (1 - ci) / 2
+    metrics = {}
+    for metric in METRICS:
+        replicates_metric = np.concatenate(replicates[metric])
+        valid = ~np.isnan(replicates_metric).all(axis=0)
+        low, high = np.full((2, latencies.shape[1]), np.nan)
+        if valid.any():
+            low[valid], high[valid] = np.nanquantile(replicates_metric[:, valid], [alpha, 1 - alpha], axis=0)
+        metrics[metric] = (estimate[metric], low, high)
+
+    return metrics
+
+
+def evaluate(df, methods=None, n_boot=2000, ci=0.95, seed=0, by_subject=True):
+    """Evaluate the latency methods on the trials with a ground truth latency
+    :param df: dataframe with columns sub_id, gt and one column per method (see main.results_dataframe)
+    :param methods: columns of the methods to evaluate (default: the ones of METHODS in df)
+    :param n_boot: number of bootstrap replicates
+    :param ci: level of the confidence intervals
+    :param seed: seed of the bootstrap
+    :param by_subject: if True, evaluate each subject besides all trials together
+    :return df_eval: dataframe with one row per sub_id ('all' for all trials) and method, with columns num_trials and,
+    for each metric, the estimate and the limits of the confidence interval (e.g., mae, mae_low, mae_high)
+    """
+    methods = [method for method in METHODS if method in df] if methods is None else list(methods)
+    df = df[df['gt'].notna()]
+    rng = np.random.default_rng(seed)
+    groups = [('all', df)] + (list(df.groupby('sub_id', sort=False)) if by_subject else [])
+
+    rows = []
+    for sub_id, df_sub in groups:
+        metrics = error_metrics(df_sub[methods].to_numpy(dtype=float), df_sub['gt'].to_numpy(dtype=float), n_boot, ci,
+                                rng)
+        for idx_method, method in enumerate(methods):
+            row = {'sub_id': sub_id, 'method': method, 'num_trials': len(df_sub)}
+            for metric, (estimate, low, high) in metrics.items():
+                row.update({metric: estimate[idx_method], f'{metric}_low': low[idx_method],
+                            f'{metric}_high': high[idx_method]})
+            rows.append(row)
+
+    return pd.DataFrame(rows)
+
+
+def print_evaluation(df_eval, sub_id='all'):
+    """Print the metrics of each method for one subject ('all' for all trials)"""
+    df_sub = df_eval[df_eval['sub_id'] == sub_id]
+    if not len(df_sub):
+        return
+    print(f'Difference (samples) between gt and methods, {sub_id} ({df_sub["num_trials"].iloc[0]} trials):')
+    for _, row in df_sub.iterrows():
+        print(f'\t{row["method"]:<16}' + ', '.join(
+            f'{metric} {row[metric]:.2f} [{row[f"{metric}_low"]:.2f}, {row[f"{metric}_high"]:.2f}]'
+            for metric in METRICS))
+
+
+def _metrics(sums, num_trials):
+    """Metrics from the weighted sums of detected, errors, squared errors and absolute errors of K methods
+    :param sums: (...)x4K array
+    :param num_trials: number of trials (sum of the weights)
+    :return dict metric -> (...)xK array"""
+    count, total, total_sq, total_abs = np.split(sums, 4, axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        bias = total / count
+        std = np.sqrt(np.maximum(total_sq - total * bias, 0) / (count - 1))
+        return {'mae': total_abs / count, 'bias': bias, 'rmse': np.sqrt(total_sq / count),
+                'detection_rate': count / num_trials if num_trials else np.full_like(count, np.nan),
+                'loa_low': bias - 1.96 * std, 'loa_high': bias + 1.96 * std}
@@ -3,23 +3,204 @@ Author: Claudia Bigoni
 Date: 29.01.2021
 Description: This file starts the application to manually choose the latency of a signal (in this case motor evoked
 potentials). The application was created using PyQt5 and the layout is described in latency_gt_gui.ui.
-MEP signals must be created as .pkl saved dataframes using create_dataframe.py.
+MEP signals must be saved as a dataset (see dataset.py) using create_dataframe.py.
+The next trial is read while the current one is annotated, and the latencies of the automatic methods of epoch_c.py are
+computed in a background thread (subject by subject) and shown as dashed lines on the plot.
+Every decision is appended at once to a journal in the folder of the dataset (see AnnotationJournal), from which the
+saved latencies and the remaining MEPs are restored when the dataset is loaded again.
+MEPs are shown in random order, or (python latency_gt.py --order disagreement) the ones where the automatic methods
+disagree most come first (see queue_order).
 """
 import numpy as np
 import pandas as pd
-from PyQt5 import QtWidgets, uic
+from PyQt5 import QtCore, QtWidgets, uic
 import pyqtgraph as pg
 import sys
 import os
+import argparse
+import csv
 import datetime
+import io
+import queue
+import time
+import warnings
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dataset import MEPDataset
+from epoch_c import BASELINE_EPOCH
+from main import dataset_latencies
+
+# colors of the latencies of the automatic methods shown on the plot
+SUGGESTION_COLORS = {'lat_bigoni': (0, 200, 0), 'lat_hamada1': (0, 200, 200), 'lat_hamada2': (80, 80, 255),
+                     'lat_garvey': (200, 0, 200), 'lat_huang': (220, 220, 0), 'lat_daskalakis': (255, 128, 0)}
+JOURNAL = 'latency_gt_journal.csv'  # journal of the annotations, in the folder of the dataset
+# columns of the index of a dataset identifying a trial in the journal, whatever its row (which changes when the dataset
+# is created again, e.g. with another filter or more subjects)
+TRIAL_KEY = ('sub_id', 'trial', 'orig_trial', 'channel')
+ORDERS = ('random', 'disagreement', 'bigoni')   # orders in which MEPs are shown (see queue_order)
+
+
+def queue_order(suggestions, order):
+    """Rows of the dataset from the most to the least informative to annotate, according to the latencies of the
+    automatic methods
+    :param suggestions: array of the latencies of the automatic methods (rows x methods, columns as in
+    SUGGESTION_COLORS)
+    :param order: 'disagreement' (SD of the latencies of the methods) or 'bigoni' (distance between the latency of the
+    Bigoni method and the median latency of the other methods). Trials where the score cannot be computed (less than
+    two latencies, or no latency of the Bigoni method) come first
+    :return rows: array of rows
+    """
+    valid = ~np.isnan(suggestions)
+    if order == 'disagreement':
+        count = valid.sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = np.where(valid, suggestions, 0).sum(axis=1) / count
+            score = np.sqrt((np.where(valid, suggestions - mean[:, None], 0)**2).sum(axis=1) / count)
+        score[count < 2] = np.nan
+    elif order == 'bigoni':
+        bigoni = list(SUGGESTION_COLORS).index('lat_bigoni')
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)     # all-NaN rows
+            median = np.nanmedian(np.delete(suggestions, bigoni, axis=1), axis=1)
+        score = abs(suggestions[:, bigoni] - median)
+    else:
+        raise ValueError(f'Unknown order {order}')
+
+    return np.argsort(-np.where(np.isnan(score), np.inf, score), kind='stable')
+
+
+class AnnotationJournal:
+    """Append-only csv file of the latency decisions: one line (key of the trial, e.g. its sub_id, trial and orig_trial,
+    and latency) per decision, nan for removed trials, written to disk as soon as it is taken. A line cut by a crash is
+    discarded when the journal is opened again; when a trial has several lines, the last one is used."""
+    def __init__(self, path, columns):
+        """
+        :param path: path to the journal (created if needed)
+        :param columns: columns of the key of the trials (see TRIAL_KEY)
+        """
+        self.path = path
+        self.columns = list(columns)
+        self.keys, self.lats = [], []
+        if os.path.exists(path):
+            with open(path, 'r+b') as f:
+                content = f.read()
+                content = content[:content.rfind(b'\n') + 1]     # without a line cut by a crash
+                f.truncate(len(content))
+            if content:
+                decisions = pd.read_csv(io.BytesIO(content), dtype={'sub_id': str})
+                if list(decisions.columns) != self.columns + ['lat']:
+                    raise ValueError(f'{path} identifies the trials by {", ".join(decisions.columns[:-1])} instead '
+                                     f'of {", ".join(self.columns)}: it was not written for this dataset')
+                self.keys = list(decisions[self.columns].itertuples(index=False, name=None))
+                self.lats = decisions['lat'].tolist()
+        self._file = open(path, 'a', newline='')
+        self._writer = csv.writer(self._file, lineterminator='\n')
+        if not self._file.tell():
+            self._writer.writerow(self.columns + ['lat'])
+
+    def __len__(self):
+        return len(self.keys)
+
+    def append(self, key, lat):
+        """Add the latency of a trial (nan if removed)
+        :param key: tuple with the value of each column of the key of the trial"""
+        self.keys.append(tuple(key))
+        self.lats.append(float(lat))
+        self._writer.writerow(list(key) + [lat])
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def decisions(self):
+        """Last decision on each trial
+        :return dataframe with the columns of the key and lat"""
+        decisions = pd.DataFrame(self.keys, columns=self.columns).assign(lat=self.lats)
+
+        return decisions.drop_duplicates(self.columns, keep='last')
+
+    def close(self):
+        self._file.close()
+
+
+class RemainingTrials:
+    """Rows of the dataset still to annotate. A removed row is replaced by the last one, so removing a trial and
+    drawing a random one take constant time whatever the number of trials."""
+    def __init__(self, rows, num_rows):
+        """
+        :param rows: rows of the trials to annotate
+        :param num_rows: number of rows of the dataset
+        """
+        self._rows = np.array(rows, dtype=int)
+        self._size = len(self._rows)
+        self._position = np.full(num_rows, -1)     # position of each row in _rows, -1 if not remaining
+        self._position[self._rows] = np.arange(self._size)
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, row):
+        return self._position[row] >= 0
+
+    def random(self, rng):
+        """Random remaining row
+        :param rng: np.random.Generator"""
+        return self._rows[rng.integers(self._size)]
+
+    def remove(self, row):
+        if row not in self:
+            raise ValueError(f'Row {row} is not remaining')
+        position = self._position[row]
+        last = self._rows[self._size - 1]
+        self._rows[position] = last
+        self._position[last] = position
+        self._position[row] = -1
+        self._size -= 1
+
+    def rows(self):
+        """Array of the remaining rows"""
+        return self._rows[:self._size].copy()
+
+
+class SuggestionWorker(QtCore.QThread):
+    """Thread computing the latencies of the automatic methods of all trials of a dataset, subject by subject (see
+    main.dataset_latencies). Subjects passed to request are computed first."""
+    computed = QtCore.pyqtSignal(object, object, object)  # dataset, rows of a subject, dict method -> latencies
+
+    def __init__(self, dataset, parent=None):
+        super(SuggestionWorker, self).__init__(parent)
+        self.dataset = dataset
+        self.requests = queue.Queue()
+        self._stopped = False
+
+    def request(self, sub_id):
+        """Compute the latencies of a subject before the other ones"""
+        self.requests.put(sub_id)
+
+    def stop(self):
+        self._stopped = True
+        self.requests.put(None)
+        self.wait()
+
+    def run(self):
+        pending = self.dataset.subject_rows()
+        while pending and not self._stopped:
+            try:
+                sub_id = self.requests.get_nowait()
+            except queue.Empty:
+                sub_id = next(iter(pending))
+            rows = pending.pop(sub_id, None)
+            if rows is None:    # already computed
+                continue
+            _, latencies = dataset_latencies(self.dataset, rows)
+            self.computed.emit(self.dataset, rows, latencies)
 
 
 class MainWindow(QtWidgets.QMainWindow):
-    def __init__(self, data_dir, *args, **kwargs):
+    def __init__(self, data_dir, *args, order='random', **kwargs):
         """ Initialize the gui. This function will create a series of signal
         and slots for MainWindow
         Args:
             - MainWindow: Window where the gui will appear
+            - order: order in which MEPs are shown, one of ORDERS
         Returns:
             None
         Description: void
@@ -31,13 +212,25 @@ class MainWindow(QtWidgets.QMainWindow):
         self.data_dir = data_dir
         self.sub_id = ''
         self.trial = 0
+        self.row = None     # row of the trial in the dataset
+        self.mep = None
         self.lat = 0
+        self.rng = np.random.default_rng()
 
-        self.df_all_meps = pd.DataFrame(columns=['sub_id', 'trial', 'mep'])
-        self.df_row_idx = 0
+        self.dataset = None
+        self.sub_ids = self.trials = None   # sub_id and trial of each row of the dataset
+        self.keys = None    # key of each row of the dataset in the journal (see TRIAL_KEY)
+        self.remaining = None   # MEPs still to evaluate (RemainingTrials)
+        self.next_row = None    # trial read in advance, and its mep
+        self.next_mep = None
+        self.suggestions = None     # latencies of the automatic methods of each row (NaN until computed)
+        self.worker = None
+        self.order = order
+        self.queue = None   # rows ordered by queue_order (None for random order), and position of the next one
+        self.queue_position = 0
 
-        self.df_lat = pd.DataFrame(columns=['sub_id', 'trial', 'lat'])
-        self.df_lat_row = 0
+        self.journal = None     # latencies saved for the dataset (AnnotationJournal)
+        self.df_lat = pd.DataFrame(columns=['sub_id', 'trial', 'lat'])     # latencies loaded from a csv
 
         # Connect signals and slots
         self.button_next.clicked.connect(self.next_file)
@@ -47,14 +240,28 @@ class MainWindow(QtWidgets.QMainWindow):
         self.button_load_df_res.clicked.connect(self.load_df_res)
         self.button_load_meps.clicked.connect(self.load_all_meps_df)
         self.p = self.graphWidget.addPlot()
+        self.p.setLabel('bottom', 'Samples')
+        self.p.setLabel('left', 'Voltage [mV]')
+        # plot items are created once, and their data replaced for each trial
+        self.curve = self.p.plot(pen=pg.mkPen('w', width=2))
+        self.marker = self.p.plot([], [], pen=None, symbol='o', symbolPen=pg.mkPen(color=(255, 0, 0), width=0),
+                                  symbolBrush=pg.mkBrush(255, 0, 0), symbolSize=10)
+        self.suggestion_lines = []
+        for method, color in SUGGESTION_COLORS.items():
+            line = pg.InfiniteLine(angle=90, pen=pg.mkPen(color, width=1, style=QtCore.Qt.DashLine),
+                                   label=method[4:], labelOpts={'position': 0.95, 'color': color})
+            line.setVisible(False)
+            self.p.addItem(line)
+            self.suggestion_lines.append(line)
         self.graphWidget.scene().sigMouseClicked.connect(self.onClick)
 
         self.write_on_browser('INSTRUCTIONS:\n'
-                              'Load the remaining MEP pkl file and the latencies ones by pressing on the '
-                              'buttons "Load remaining MEPs" and "Load saved latencies" respectively.\nOnce these files'
-                              ' have been loaded, MEPs from single pulse TMS of either healthy young participants or '
-                              'stroke patients will appear on the black graph plot on the bottom left.\nWhen a new MEP '
-                              'is plotted, you have 3 options:\n'
+                              'Load the MEPs (info.json file of the dataset) '
+                              'and, if saved in a csv file by a previous version of the app, the latencies by pressing '
+                              'on the buttons "Load remaining MEPs" and "Load saved latencies" respectively.\n'
+                              'Once these files have been loaded, MEPs from single pulse TMS of either healthy young '
+                              'participants or stroke patients will appear on the black graph plot on the bottom '
+                              'left.\nWhen a new MEP is plotted, you have 3 options:\n'
                               '1. Click with your cursor the point where you think the MEP begins. The point will be '
                               'represented as a red dot and the exact sample number will be reported on the very bottom'
                               ' left, underneath the plot. You can correct your choice as many times as you want by '
@@ -64,64 +271,100 @@ class MainWindow(QtWidgets.QMainWindow):
                               'You will be taken to the next MEP and that MEP will reappear later on.\n'
                               '3. If you think there is no MEP present on the plot (e.g. too much noise or too little '
                               'amplitude) press the "Not MEP: remove" button and the trial will be removed.\n'
+                              'Dashed lines show the latencies found by the automatic methods, once computed.\n'
                               '\n\n**** IMPORTANT!!!! ****\n\n'
-                              'Click on "Update dataframes" when you want to save your progress. First you will be '
-                              'asked to save the csv file with the latencies results; secondly the pkl file with the '
-                              'remaining MEPs.')
+                              f'Every latency is saved when you press "Next" or "Not MEP: remove", in {JOURNAL} in '
+                              'the folder of the dataset: loading the dataset again restores your progress. Click on '
+                              '"Update dataframes" to save the csv file with the latencies results.')
 
     def write_on_browser(self, s):
         self.textEdit.append(
             f'{datetime.datetime.now().time()}\t-\t{s}')
 
     def plot_mep(self):
-        self.p.clear()
-        self.p.setLabel('bottom', 'Samples')
-        self.p.setLabel('left', 'Voltage [mV]')
-        self.p.plot(y=self.mep, pen=pg.mkPen('w', width=2))
+        self.curve.setData(y=self.mep)
+        self.marker.setData([], [])
+        self.plot_suggestions()
+
+    def plot_suggestions(self):
+        """Show the latencies of the automatic methods computed for the current trial"""
+        latencies = self.suggestions[self.row] if self.suggestions is not None else [np.nan] * len(SUGGESTION_COLORS)
+        for line, latency in zip(self.suggestion_lines, latencies):
+            line.setVisible(not np.isnan(latency))
+            if not np.isnan(latency):
+                line.setValue(latency)
+
+    def on_suggestions(self, dataset, rows, latencies):
+        """Store the latencies computed by the worker for the trials of a subject"""
+        if dataset is not self.dataset:
+            # emitted by the worker of a dataset loaded before, before it was stopped
+            return
+        self.suggestions[rows] = np.column_stack([latencies[method] for method in SUGGESTION_COLORS])
+        if self.row in rows:
+            self.plot_suggestions()
 
     def onClick(self, event):
         items = self.graphWidget.scene().items(event.scenePos())
         mousePoint = self.p.vb.mapSceneToView(event._scenePos)
         print(mousePoint.x(), mousePoint.y())
         self.lat = int(mousePoint.x())
-        self.p.plot([int(mousePoint.x())], [self.mep[int(mousePoint.x())]], symbol='o',
-                    symbolPen=pg.mkPen(color=(255, 0, 0), width=0), symbolBrush=pg.mkBrush(255, 0, 0),
-                    symbolSize=10)
+        self.marker.setData([self.lat], [self.mep[self.lat]])
         self.label_lat.setNum(self.lat)
 
     def next_file(self):
-        """load next mep"""
+        """load next mep, then read the following one in advance"""
+        if self.remaining is None:
+            self.write_on_browser('Load the MEPs first.')
+            return
+        if not len(self.remaining):
+            self.write_on_browser('All MEPs have been evaluated.')
+            self.save_df()
+            return
         self.get_random_trial()
         self.plot_mep()
+        self.prefetch()
 
     def save_lat(self):
         """save in dataframe the ground truth latency"""
-        self.df_lat.loc[self.df_lat_row] = pd.Series({
-            'sub_id': self.sub_id, 'trial': self.trial, 'lat': self.lat
-        })
-        self.df_lat_row += 1
+        if not self.annotating():
+            return
+        self.journal.append(self.keys[self.row], self.lat)
         self.write_on_browser('New latency saved in dataframe. Going to next trial.')
-        self.df_all_meps = self.df_all_meps.drop(self.df_all_meps.index[self.trial_idx])
+        self.remaining.remove(self.row)
         self.next_file()
 
     def remove_trial(self):
         """No mep present, latency to NaN"""
-        self.df_lat.loc[self.df_lat_row] = pd.Series({
-            'sub_id': self.sub_id, 'trial': self.trial, 'lat': 'nan'
-        })
-        self.df_lat_row += 1
+        if not self.annotating():
+            return
+        self.journal.append(self.keys[self.row], 'nan')
         self.write_on_browser('This trial will have a null latency. Going to next trial.')
-        self.df_all_meps = self.df_all_meps.drop(self.df_all_meps.index[self.trial_idx])
+        self.remaining.remove(self.row)
         self.next_file()
 
+    def annotating(self):
+        """Whether a trial still to annotate is shown (not after the last one, nor before loading the MEPs)"""
+        if self.row is None or self.row not in self.remaining:
+            self.write_on_browser('No MEP to annotate.' if self.remaining is None or len(self.remaining)
+                                  else 'All MEPs have been evaluated.')
+            return False
+
+        return True
+
     def save_df(self):
-        """Save the dataframe with ground truth latency (csv) and updated dataframe with MEP to still evaluate (pkl)"""
+        """Save the dataframe with ground truth latency (csv): the latencies loaded from a csv, then the ones of the
+        journal"""
         filename = self.file_save('Save latencies dataframe (csv)')
-        self.df_lat.to_csv(filename)
+        if not filename:
+            return
+        df_lat = self.df_lat
+        if self.journal is not None and len(self.journal):
+            # decisions on the trials of the dataset, with the channel of each trial too for multichannel datasets
+            columns = [column for column in ('sub_id', 'trial', 'channel') if column in self.dataset.index]
+            df_journal = self.journal.decisions().merge(self.dataset.index[self.journal.columns])[columns + ['lat']]
+            df_lat = pd.concat([df_lat, df_journal], ignore_index=True) if len(df_lat) else df_journal
+        df_lat.to_csv(filename, na_rep='nan')
         self.write_on_browser(f'Saved dataframe with ground truth latencies in {filename}')
-        filename = self.file_save('Save dataframe (pkl) with missing MEPs.')
-        self.df_all_meps.to_pickle(filename)
-        self.write_on_browser(f'Saved dataframe with missing MEPs to evaluate in {filename}.')
 
     def file_save(self, capt):
         filename, _ = QtWidgets.QFileDialog.getSaveFileName(None, caption=capt,
@@ -129,23 +372,100 @@ class MainWindow(QtWidgets.QMainWindow):
         return filename
 
     def get_random_trial(self):
+        """Current trial: the one read in advance if still to evaluate, otherwise a random remaining one"""
+        if self.next_row is not None and self.next_row in self.remaining:
+            self.row, self.mep = self.next_row, self.next_mep
+        else:
+            self.row = self.draw_row()
+            self.mep = np.array(self.dataset.mep(self.row))
+        self.sub_id = self.sub_ids[self.row]
+        self.trial = self.trials[self.row]
+        if self.worker is not None:
+            self.worker.request(self.sub_id)
+
+    def prefetch(self):
+        """Read from disk the next trial while the current one is evaluated, and compute its subject first"""
+        self.next_row = self.draw_row(exclude=self.row)
+        self.next_mep = np.array(self.dataset.mep(self.next_row))
+        if self.worker is not None:
+            self.worker.request(self.sub_ids[self.next_row])
+
+    def draw_row(self, exclude=None):
+        """Random remaining row, or next remaining row of the queue (other than exclude, unless it is the only one). The
+        queue starts again from its beginning when its end is reached, so skipped MEPs come back"""
+        if self.queue is None:
+            row = self.remaining.random(self.rng)
+            while row == exclude and len(self.remaining) > 1:
+                row = self.remaining.random(self.rng)
+            return row
+        for _ in range(len(self.queue)):
+            row = self.queue[self.queue_position]
+            self.queue_position = (self.queue_position + 1) % len(self.queue)
+            if row in self.remaining and row != exclude:
+                return row
+
+        return exclude
+
+    def set_dataset(self, dataset):
+        """Evaluate the trials of a dataset, except the ones already in its journal, and start computing the latencies
+        of the automatic methods
+        :return False if the journal of the dataset cannot be used (the dataset is then not loaded)"""
+        columns = [column for column in TRIAL_KEY if column in dataset.index]
         try:
-            self.trial_idx = np.random.randint(0, len(self.df_all_meps.index), 1)[0]
-            self.sub_id = self.df_all_meps.loc[self.df_all_meps.index[self.trial_idx]]['sub_id']
-            self.mep = self.df_all_meps.loc[self.df_all_meps.index[self.trial_idx]]['mep'][0]
-            self.trial = self.df_all_meps.loc[self.df_all_meps.index[self.trial_idx]]['trial']
-        except Exception:
-            self.save_df()
+            journal = AnnotationJournal(os.path.join(dataset.path, JOURNAL), columns)
+        except ValueError as e:
+            self.write_on_browser(f'{e}. Move it away to annotate this dataset.')
+            return False
+        if self.worker is not None:
+            self.worker.stop()
+        if self.journal is not None:
+            self.journal.close()
+        self.dataset = dataset
+        self.journal = journal
+        self.sub_ids = dataset.index['sub_id'].to_numpy()
+        self.trials = dataset.index['trial'].to_numpy()
+        self.keys = list(dataset.index[columns].itertuples(index=False, name=None))
+        journaled = pd.MultiIndex.from_frame(dataset.index[columns]).isin(self.journal.keys)
+        self.remaining = RemainingTrials(np.flatnonzero(~journaled), len(dataset))
+        if len(self.journal):
+            self.write_on_browser(f'Restored the latencies of {np.sum(journaled)} MEPs saved in {self.journal.path}.')
+            ignored = len(self.journal.decisions()) - np.sum(journaled)
+            if ignored:
+                self.write_on_browser(f'{ignored} MEPs of the journal are no longer in the dataset: their latencies '
+                                      f'are not used.')
+        self.row = None
+        self.next_row = None
+        self.queue = None
+        self.suggestions = np.full((len(dataset), len(SUGGESTION_COLORS)), np.nan)
+        self.worker = None
+        if not dataset.contains(*BASELINE_EPOCH):
+            self.write_on_browser('The dataset does not include the pre-stimulus EMG: the latencies of the automatic '
+                                  'methods are not shown, and MEPs are shown in random order.')
+        elif self.order != 'random':
+            # the latencies of all trials are needed to order them: they are computed now, subject by subject
+            t_start = time.perf_counter()
+            for sub_rows in dataset.subject_rows().values():
+                _, latencies = dataset_latencies(dataset, sub_rows)
+                self.suggestions[sub_rows] = np.column_stack([latencies[method] for method in SUGGESTION_COLORS])
+            self.queue = queue_order(self.suggestions, self.order)
+            self.queue_position = 0
+            self.write_on_browser(f'Computed the latencies of the automatic methods in '
+                                  f'{time.perf_counter() - t_start:.1f} s: MEPs are shown by {self.order} order.')
+        else:
+            self.worker = SuggestionWorker(dataset)
+            self.worker.computed.connect(self.on_suggestions)
+            self.worker.start()
+
+        return True
 
     def load_all_meps_df(self):
         options = QtWidgets.QFileDialog.Options()
         options |= QtWidgets.QFileDialog.DontUseNativeDialog
         file_dir = os.path.join(self.data_dir)
         filename, _ = QtWidgets.QFileDialog.getOpenFileName(
-            None, caption='Load dataframe with remaining MEPs', directory=file_dir, filter='(*.pkl)',
-            options=options)
-        self.df_all_meps = pd.read_pickle(filename)
-        self.df_row_idx = 0
+            None, caption='Load dataset (info.json)', directory=file_dir, filter='(info.json)', options=options)
+        if not filename or not self.set_dataset(MEPDataset(os.path.dirname(filename))):
+            return
         self.write_on_browser('Loaded the dataframe with missing MEPs.')
         self.write_on_browser("Loading first MEP")
         self.next_file()
@@ -157,20 +477,28 @@ class MainWindow(QtWidgets.QMainWindow):
         filename, _ = QtWidgets.QFileDialog.getOpenFileName(
             None, caption='Load dataframe with initial results', directory=file_dir, filter='(*.csv)',
             options=options)
-        self.df_lat = pd.read_csv(os.path.join(data_dir, filename))
+        df_lat = pd.read_csv(os.path.join(data_dir, filename))
+        self.df_lat = df_lat[[column for column in ('sub_id', 'trial', 'channel', 'lat') if column in df_lat]]
         self.write_on_browser('Loaded the dataframe with some initial results.')
-        self.df_lat_row = len(self.df_lat)
 
     def closeEvent(self, event):
-        # save
-        self.save_df()
+        # latencies are already in the journal
+        if self.journal is not None:
+            self.journal.close()
+        if self.worker is not None:
+            self.worker.stop()
         event.accept()  # let the window close
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Ground truth latency app')
+    parser.add_argument('--order', choices=ORDERS, default='random',
+                        help='order of the MEPs: random, or most informative first (disagreement between the automatic '
+                             'methods, or distance of the Bigoni method from the others)')
+    args, qt_args = parser.parse_known_args()
     data_dir = os.getcwd()
-    app = QtWidgets.QApplication(sys.argv)
-    main = MainWindow(data_dir)
+    app = QtWidgets.QApplication(sys.argv[:1] + qt_args)
+    main = MainWindow(data_dir, order=args.order)
     main.setWindowTitle('Latency ground truth')
     main.show()
     sys.exit(app.exec_())
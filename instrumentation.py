@@ -0,0 +1,115 @@
+"""
+Date: 17.10.2026
+Description: Instrumentation of the latency pipeline: time spent in each stage, failures of the latency methods by
+reason, optional peak memory of each stage and optional profiling, gathered in a json report per run.
+"""
+import cProfile
+import json
+import pstats
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+
+class Instrumentation:
+    """Collect stage timers, failure counters and (optionally) peak memory and profiling statistics. Reports of several
+    instances (e.g., one per worker process) are combined with merge."""
+    def __init__(self, profile=False, trace_memory=False):
+        """
+        :param profile: if True, run the profiler (cProfile) during the stages
+        :param trace_memory: if True, record the peak memory allocated (tracemalloc, which numpy arrays report to)
+        during each stage. Tracing slows down the allocations
+        """
+        self.time = defaultdict(float)      # seconds spent in each stage
+        self.calls = Counter()              # number of times each stage was run
+        self.peak = defaultdict(int)        # peak memory allocated during each stage (bytes)
+        self.failures = defaultdict(Counter)    # method -> reason -> number of trials
+        self.trials = Counter()             # method -> number of trials processed
+        self.profile_stats = defaultdict(lambda: [0, 0., 0.])   # function -> [calls, total time, cumulative time]
+        self.profile = profile
+        self._profiler = cProfile.Profile() if profile else None
+        self.trace_memory = trace_memory
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name):
+        """Context manager timing (and profiling, if enabled) a stage of the pipeline
+        :param name: name of the stage"""
+        if self._profiler is not None:
+            self._profiler.enable()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        t_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.time[name] += time.perf_counter() - t_start
+            self.calls[name] += 1
+            if self.trace_memory:
+                self.peak[name] = max(self.peak[name], tracemalloc.get_traced_memory()[1])
+            if self._profiler is not None:
+                self._profiler.disable()
+
+    def count_failures(self, failures, num_trials):
+        """Add the failures of the latency methods on a set of trials
+        :param failures: dict, method -> Counter of reason -> number of trials (e.g., EpochBatch.failures)
+        :param num_trials: number of trials on which each method was run"""
+        for method, reasons in failures.items():
+            self.failures[method].update(reasons)
+            self.trials[method] += num_trials
+
+    def report(self):
+        """Report of the run
+        :return dict with stages (time_s, calls and, if tracing memory, peak_mb of each stage), failures (count of each
+        reason and failure_rate of each method) and, if profiling, profile (the 30 functions with the highest
+        cumulative time)"""
+        self._collect_profile()
+        report = {'stages': {name: {'time_s': self.time[name], 'calls': self.calls[name],
+                                    **({'peak_mb': self.peak[name] / 2**20} if name in self.peak else {})}
+                             for name in self.time},
+                  'failures': {method: {'trials': self.trials[method],
+                                        'failure_rate': sum(reasons.values()) / self.trials[method]
+                                        if self.trials[method] else 0.,
+                                        'reasons': dict(reasons)}
+                               for method, reasons in self.failures.items()}}
+        if self.profile_stats:
+            functions = sorted(self.profile_stats.items(), key=lambda item: item[1][2], reverse=True)[:30]
+            report['profile'] = [{'function': function, 'calls': calls, 'time_s': tot_time, 'cum_time_s': cum_time}
+                                 for function, (calls, tot_time, cum_time) in functions]
+
+        return report
+
+    def merge(self, report):
+        """Add to this instance the report of another one"""
+        for name, stage in report['stages'].items():
+            self.time[name] += stage['time_s']
+            self.calls[name] += stage['calls']
+            if 'peak_mb' in stage:
+                self.peak[name] = max(self.peak[name], int(stage['peak_mb'] * 2**20))
+        for method, failures in report['failures'].items():
+            self.failures[method].update(failures['reasons'])
+            self.trials[method] += failures['trials']
+        for function in report.get('profile', []):
+            stats = self.profile_stats[function['function']]
+            stats[0] += function['calls']
+            stats[1] += function['time_s']
+            stats[2] += function['cum_time_s']
+
+    def save(self, path):
+        """Save the report as json"""
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+    def _collect_profile(self):
+        """Move the statistics of the profiler to profile_stats"""
+        if self._profiler is None or not self._profiler.getstats():
+            return
+        for (filename, line, function), (_, calls, tot_time, cum_time, _) in \
+                pstats.Stats(self._profiler).stats.items():
+            stats = self.profile_stats[f'{filename}:{line}({function})']
+            stats[0] += calls
+            stats[1] += tot_time
+            stats[2] += cum_time
+        self._profiler = cProfile.Profile()
@@ -4,104 +4,393 @@ Date: 23.06.2021
 Description: Run comparison of automatic latency detection, with possible addition of comparison to ground truth (i.e.,
 latencies manually detected using the software).
 """
+import argparse
 import os
 import numpy as np
 import pandas as pd
-from scipy import stats
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 
+import evaluation
 import preprocessing as pp
-from epoch_c import Epoch
+import triggers
+from cache import ResultCache
+from dataset import MEPDataset
+from epoch_c import EpochBatch, BASELINE_EPOCH
+from instrumentation import Instrumentation
+from results_writer import ResultWriter
 
-if __name__ == '__main__':
-    data_dir = 'data'   # Insert here the path to your data folder
-    fs = 5000   # EMG data sampling frequency in Hz
-
-    df_gt = pd.read_csv('')[['sub_id', 'trial', 'lat']]     # path to the ground truth file
-    # dataframe to save results
-    df = pd.DataFrame(columns=['sub_id', 'trial', 'lat_bigoni', 'lat_hamada1', 'lat_hamada2', 'lat_huang',
-                               'lat_garvey', 'lat_daskalakis', 'gt'])
-    df_row = 0
-    subjects = sorted([i for i in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, i))])
-    for sub_id in subjects:
+# Epoch windows (t_min, t_max around the trigger, in s) used for rejection and latency: only the samples spanning them
+# are loaded from the recordings
+WINDOWS = [(0.01, 0.05), (-0.025, -0.005), (-0.2, -0.02), (-0.2, -0.002), (-0.1, -0.002), (-0.04, -0.002)]
+# Parameters of the trial rejection (see pp.reject_trials)
+REJECTION = {'thr_corr': 0.3, 'ptp_percentile': 25, 'criteria': ('corr',)}
+
+
+def process_subject(path, fs, instrumentation=None, cache=None, dtype=None, filtering=None, continuous=None):
+    """Compute the latency of the trials of one subject, with all methods.
+    :param path: path to the subject EMG_data_SP.npy file (MxN array, M samples, N trials, trigger at 1 s; or MxNxC
+    array, C channels, each rejected and processed as its own set of trials)
+    :param fs: sampling frequency (Hz)
+    :param instrumentation: Instrumentation collecting the time of each stage and the failures of the methods
+    :param cache: ResultCache from which the latencies are taken if the recording was already processed
+    :param dtype: dtype used for the processing (default: the one of the recording). With 'float32' the memory is
+    halved; thresholds are then compared in single precision, so a trial whose signal is within round-off (~1e-6
+    relative) of a threshold can get a different latency than in float64
+    :param filtering: dict with the parameters of pp.filter_design (e.g., {'band': (20, 1000), 'notch': (50, 100)}) of
+    the zero-phase filter applied to the recording before rejection and latency, None for no filtering
+    :param continuous: for a continuous recording (M samples, or MxC) instead of epochs, dict with the parameters of
+    triggers.load_recording_windows (e.g., {'channel': [0, 1], 'trigger_channel': 2}): only the windows around the
+    detected triggers are read. None for a recording of epochs
+    :return latencies: dict, for each method an array with the latency of each trial kept after rejection. For several
+    channels, the trials kept in each channel follow each other, and the channel and trial (index among the kept
+    trials of the channel) of each latency are added
+    """
+    instrumentation = instrumentation if instrumentation is not None else Instrumentation()
+    if cache is not None:
+        with instrumentation.stage('cache'):
+            key = cache.key(path, {'fs': fs, 'windows': WINDOWS, 'rejection': REJECTION,
+                                   'dtype': None if dtype is None else np.dtype(dtype).str, 'filtering': filtering,
+                                   'continuous': continuous})
+            cached = cache.get(key)
+        if cached is not None:
+            latencies, info = cached
+            instrumentation.count_failures(info['failures'], info['num_trials'])
+            return latencies
+
+    with instrumentation.stage('load'):
+        sos = pp.filter_design(fs, **filtering) if filtering else None
+        if continuous is not None:
+            epochs_emg, sample_offset = triggers.load_recording_windows(path, fs, WINDOWS, dtype=dtype, sos=sos,
+                                                                        **continuous)
+        else:
+            epochs_emg, sample_offset = pp.load_epochs_windows(path, fs, WINDOWS, dtype=dtype, sos=sos)
+    # Pre-process EMG (following methods of Hussain et al., 2019) - NB: this is the same preprocessing used to
+    # create the dataframe for the ground truth application. This makes it easy to compare the ground truth
+    # latencies with the ones automatically computed by the algorithm for the same trials
+    with instrumentation.stage('epoching'):
+        # Look for MEP in 10-50ms after tms pulse
+        epochs_mep = pp.divide_in_epochs(epochs_emg, fs, 1, 0.01, 0.05, sample_offset)
+        epochs_baseline = pp.divide_in_epochs(epochs_emg, fs, 1, -0.025, -0.005, sample_offset)
+    # Trials automatic rejection based on (a) each MEP correlation with the average MEP signal for that subject,
+    # (b) magnitude of MEP and (c) baseline (i.e., 25 ms before the pulse), removing trials where at least half of
+    # the baseline power is above a threshold (Hussain et al., 2019). Only (a) is used to remove trials
+    with instrumentation.stage('rejection'):
+        keep, _ = pp.reject_trials(epochs_mep, epochs_baseline, **REJECTION)
+
+    # compute latency of all trials (and channels) at once. Good trials are selected by the keep mask rather than by
+    # copying them: the latency of the others is NaN, and Hamada method 1 uses the 200 to 20 ms pre-stimulus EMG of
+    # the kept trials only
+    with instrumentation.stage('baseline_stats'):
+        epochs = EpochBatch(epochs_mep, epochs_emg, fs, 1, sample_offset, keep=keep)
+    latencies = epochs.latency_all_methods(stage=instrumentation.stage)
+    if epochs_emg.ndim == 3:
+        latencies = _kept_channel_trials(latencies, keep)
+    else:
+        latencies = {method: latency[keep] for method, latency in latencies.items()}
+    instrumentation.count_failures(epochs.failures, int(np.sum(keep)))
+    if cache is not None:
+        with instrumentation.stage('cache'):
+            cache.put(key, latencies, {'failures': epochs.failures, 'num_trials': int(np.sum(keep))})
+
+    return latencies
+
+
+def find_recordings(data_dir):
+    """Recordings (EMG_data_SP.npy files) in the folders of data_dir, at any depth
+    :param data_dir: path to the data folder
+    :return list of (sub_id, path) tuples sorted by sub_id, sub_id being the folder of the recording relative to
+    data_dir (e.g., sub01 or site1/sub01)"""
+    recordings = []
+    for folder, _, files in os.walk(data_dir):
+        if 'EMG_data_SP.npy' in files and folder != data_dir:
+            sub_id = os.path.relpath(folder, data_dir).replace(os.sep, '/')
+            recordings.append((sub_id, os.path.join(folder, 'EMG_data_SP.npy')))
+
+    return sorted(recordings)
+
+
+def iter_cohort(recordings, fs, n_jobs=1, instrumentation=None, cache=None, dtype=None, filtering=None,
+                continuous=None):
+    """Compute the latencies of several recordings, yielding the results of each one as soon as it (and the ones before
+    it) is processed. With n_jobs > 1 recordings are processed in parallel, each by a worker process that loads its own
+    data.
+    :param recordings: list of (sub_id, path) tuples (see find_recordings)
+    :param fs: sampling frequency (Hz)
+    :param n_jobs: number of worker processes
+    :param instrumentation: Instrumentation to which the reports of all subjects are added
+    :param cache: ResultCache shared by the workers; subjects whose recording was already processed are not processed
+    again
+    :param dtype: dtype used for the processing (see process_subject)
+    :param filtering: filter applied to the recordings (see process_subject)
+    :param continuous: trigger detection of continuous recordings (see process_subject)
+    :return generator of (sub_id, latencies, error) tuples in the order of recordings: latencies is None and error the
+    error message if the subject could not be processed
+    """
+    paths = [path for _, path in recordings]
+    options = [(instrumentation is not None and instrumentation.profile,
+                instrumentation is not None and instrumentation.trace_memory, cache, dtype, filtering,
+                continuous)] * len(paths)
+    with ProcessPoolExecutor(max_workers=n_jobs) if n_jobs > 1 else nullcontext() as executor:
+        mapper = executor.map if n_jobs > 1 else map
+        for (sub_id, _), (latencies, report, error) in zip(recordings, mapper(_run_subject, paths, [fs] * len(paths),
+                                                                              options)):
+            if instrumentation is not None:
+                instrumentation.merge(report)
+            if error is None:
+                print(f'subject: {sub_id}')
+            else:
+                print(f'subject: {sub_id} - failed: {error}')
+            yield sub_id, latencies, error
+
+
+def run_cohort(data_dir, fs, n_jobs=1, instrumentation=None, cache=None, dtype=None, filtering=None,
+               continuous=None):
+    """Compute the latencies of all subjects in data_dir (see find_recordings and iter_cohort)
+    :return results: list of (sub_id, latencies) tuples in subject order (see process_subject)
+    :return failures: dict, error message of each subject that could not be processed
+    """
+    results, failures = [], {}
+    for sub_id, latencies, error in iter_cohort(find_recordings(data_dir), fs, n_jobs, instrumentation, cache, dtype,
+                                                filtering, continuous):
+        if error is None:
+            results.append((sub_id, latencies))
+        else:
+            failures[sub_id] = error
+
+    return results, failures
+
+
+def process_dataset(path, instrumentation=None, skip=(), dtype=None):
+    """Compute the latencies of the trials of a dataset (see dataset.py), e.g. the one annotated with the ground truth
+    app. Trials in the dataset were already selected by the rejection, so all of them are used.
+    :param path: folder of the dataset
+    :param instrumentation: Instrumentation collecting the time of each stage and the failures of the methods
+    :param skip: subjects not to process (e.g., the ones finished by a previous run)
+    :param dtype: dtype used for the processing (default: the one of the dataset, see process_subject)
+    :return generator of (sub_id, latencies) tuples (see run_cohort), yielded as each subject is processed, latencies
+    including the trial (and channel) of each latency from the index of the dataset
+    """
+    instrumentation = instrumentation if instrumentation is not None else Instrumentation()
+    dataset = MEPDataset(path)
+    if not dataset.contains(*BASELINE_EPOCH):
+        raise ValueError(f'Dataset {path} does not include the pre-stimulus epochs needed by the latency methods')
+    subject_rows = dataset.subject_rows()
+    subjects = {sub_id: rows for sub_id, rows in subject_rows.items() if sub_id not in skip}
+    print(f'{len(subjects)} subjects to process ({len(subject_rows) - len(subjects)} already processed)')
+    for sub_id, rows in subjects.items():
+        failures, latencies = dataset_latencies(dataset, rows, instrumentation.stage, dtype)
+        index = dataset.index.iloc[rows]
+        # channel is -1 for the single-channel recordings of a dataset with multichannel ones
+        columns = ['channel', 'trial'] if 'channel' in index and (index['channel'] >= 0).all() else ['trial']
+        instrumentation.count_failures(failures, len(rows))
         print(f'subject: {sub_id}')
-        try:
-            epochs_emg = np.load(os.path.join(data_dir, sub_id, 'EMG_data_SP.npy'))
-        except OSError:
-            continue
-        # Pre-process EMG (following methods of Hussain et al., 2019) - NB: this is the same preprocessing used to
-        # create the dataframe for the ground truth application. This makes it easy to compare the ground truth
-        # latencies with the ones automatically computed by the algorithm for the same trials
-        epochs_mep = pp.divide_in_epochs(epochs_emg, fs, 1, 0.01, 0.05)     # Look for MEP in 10-50ms after tms pulse
-        ptp = pp.peak_to_peak_amplitude(epochs_mep)     # Compute peak-to-peak amplitude
-        # Trials automatic rejection based on (a) each MEP correlation with the average MEP signal for that subject and
-        # (b) magnitude of MEP
-        remove_corr, remove_small_mep = [], []
-        average_mep = np.mean(epochs_mep, axis=1)
-        thr_ptp_value = np.percentile(ptp, 25)
-        for idx_e, epoch in enumerate(epochs_mep.T):
-            remove_corr.append(pp.correlation_bigger_than(epoch, average_mep))
-            remove_small_mep.append(pp.bigger_than(ptp[idx_e], thr_ptp_value))
-        idx_remove_corr = np.argwhere(np.asarray(remove_corr) == 0).flatten()
-        idx_remove_small_mep = np.argwhere(np.asarray(remove_small_mep) == 0).flatten()
-
-        # b. Trials are removed based on baseline (i.e., 25 ms before the pulse) and remove trials where at least half
-        # of the baseline power is above a threshold (Hussain et al., 2019)
-        epochs_baseline = pp.divide_in_epochs(epochs_emg, fs, 1, -0.025, -0.005)    # Divide in epochs
-        remove_baseline = []
-        for epoch in epochs_baseline.T:
-            epoch_power = abs(epoch)**2
-            thr_power_baseline = np.percentile(epoch_power, 75) + 3 * stats.iqr(epoch_power)
-            remove_baseline.append(pp.half_signal_bigger_than(abs(epoch), thr_power_baseline))
-        idx_remove_baseline = np.argwhere(remove_baseline == 1).flatten()
-
-        # epochs_baseline_ham_gar = pp.divide_in_epochs(epochs_emg, fs, 1, -0.100, -0.001)
-        # epochs_baseline_hu = pp.divide_in_epochs(epochs_emg, fs, 1, -0.200, -0.001)
-        # epochs_baseline_das = pp.divide_in_epochs(epochs_emg, fs, 1, -0.04, -0.001)
-
-        # 2. Remove trials containing artifacts in either mep or baseline emg
-        idx_remove = set(list(idx_remove_baseline) + list(idx_remove_corr))
-        num_trials = epochs_emg.shape[1]
-        idx_keep = np.setdiff1d(range(0, num_trials), list(idx_remove))
-
-        # Keep only good trials
-        epochs_baseline_ham_gar = epochs_baseline_ham_gar[:, idx_keep]
-        epochs_baseline_hu = epochs_baseline_hu[:, idx_keep]
-        epochs_baseline_das = epochs_baseline_das[:, idx_keep]
-        epochs_mep = epochs_mep[:, idx_keep]
-        epochs_emg = epochs_emg[:, idx_keep]
-        ptp = ptp[idx_keep]
-
-        # go through trials and compute latency
-        baseline_hamada = pp.divide_in_epochs(epochs_emg, fs, 1, -0.2, -0.02)
-        for idx_e, mep in enumerate(epochs_mep.T):
-            epoch = Epoch(mep, epochs_emg[:, idx_e], fs, 1)
-            latency_bigoni = epoch.latency_bigoni_method()
-            latency_hamada1 = epoch.latency_method_hamada_1(baseline_hamada)
-            latency_hamada2 = epoch.latency_method_hamada_2()
-            latency_garvey = epoch.latency_method_garvey_revised()
-            latency_huang = epoch.latency_method_huang()
-            latency_daskalakis = epoch.latency_method_daskalakis()
-
-            # Ground truth data
-            latency_gt = (df_gt[((df_gt['sub_id'] == sub_id) & (df_gt['trial'] == idx_e))]['lat']).values[0]
-
-            # Save results to dataframe
-            df.loc[df_row] = pd.Series({'sub_id': sub_id, 'trial': idx_e, 'lat_bigoni': latency_bigoni,
-                                        'lat_hamada1': latency_hamada1, 'lat_hamada2': latency_hamada2,
-                                        'lat_huang': latency_huang, 'lat_garvey': latency_garvey,
-                                        'lat_daskalakis': latency_daskalakis, 'gt': latency_gt})
-            df_row += 1
-
-    # Check out some qualitative comparisons
-    print(f'Difference (samples) between gt and Bigoni method: '
-          f'\n\tmean: {np.mean(abs(df["gt"].values - df["lat_bigoni"].values))}'
-          f'\n\tmean std: {np.std(abs(df["gt"].values - df["lat_bigoni"].values))}')
-    print(f'Difference (samples) between gt and Huang method: '
-          f'\n\tmean: {np.mean(abs(df["gt"].values - df["lat_huang"].values))}'
-          f'\n\tmean std: {np.std(abs(df["gt"].values - df["lat_huang"].values))}')
-    print(f'Difference (samples) between gt and Hamada1 method: '
-          f'\n\tmean: {np.mean(abs(df["gt"].values - df["lat_hamada1"].values))}'
-          f'\n\tmean std: {np.std(abs(df["gt"].values - df["lat_hamada1"]))}')
-    print(f'Difference (samples) between gt and Hamada2 method: '
-          f'\n\tmean: {np.mean(abs(df["gt"].values - df["lat_hamada2"].values))}'
-          f'\n\tmean std: {np.std(abs(df["gt"].values - df["lat_hamada2"].values))}')
+        yield sub_id, {**{column: index[column].to_numpy(dtype=int) for column in columns}, **latencies}
+
+
+def dataset_latencies(dataset, rows, stage=None, dtype=None):
+    """Latencies of all methods of some trials of a dataset (e.g., the trials of a subject, so that Hamada method 1
+    pools their baselines), computed together. In multichannel datasets, the trials of each channel are computed
+    together, separately from the other channels (as in process_subject)
+    :param dataset: MEPDataset including the pre-stimulus epochs (BASELINE_EPOCH)
+    :param rows: rows of the trials in the dataset
+    :param stage: function returning a context manager run around each stage, given its name (e.g.,
+    Instrumentation.stage)
+    :param dtype: dtype used for the processing (default: the one of the dataset)
+    :return failures: dict, method -> Counter of reason -> number of trials (see EpochBatch.failures)
+    :return latencies: dict, one array of latencies for each method, in the order of rows
+    """
+    stage = stage if stage is not None else (lambda name: nullcontext())
+    rows = np.asarray(rows, dtype=int)
+    channels = dataset.index['channel'].to_numpy()[rows] if 'channel' in dataset.index else np.zeros(len(rows))
+    failures, latencies = defaultdict(Counter), {}
+    for channel in np.unique(channels):
+        channel_trials = channels == channel
+        with stage('load'):
+            epochs_emg = np.asarray(dataset.epochs[rows[channel_trials]], dtype=dtype).T    # samples x trials
+        with stage('epoching'):
+            epochs_mep = pp.divide_in_epochs(epochs_emg, dataset.fs, dataset.t_time, 0.01, 0.05,
+                                             dataset.sample_offset)
+        with stage('baseline_stats'):
+            epochs = EpochBatch(epochs_mep, epochs_emg, dataset.fs, dataset.t_time, dataset.sample_offset)
+        for method, latency in epochs.latency_all_methods(stage=stage).items():
+            latencies.setdefault(method, np.full(len(rows), np.nan))[channel_trials] = latency
+        for method, reasons in epochs.failures.items():
+            failures[method].update(reasons)
+
+    return failures, latencies
+
+
+def results_dataframe(results, df_gt=None):
+    """Gather the results of run_cohort in a dataframe with one row per trial, and add the ground truth latencies.
+    :param results: list of (sub_id, latencies) tuples (see run_cohort)
+    :param df_gt: dataframe with the ground truth latency ('lat') of each 'sub_id' and 'trial', None if not available
+    :return df: dataframe with columns sub_id, trial, channel (for multichannel recordings), one column per method and
+    gt (NaN for trials without ground truth)
+    """
+    num_trials = [len(latencies['lat_bigoni']) for _, latencies in results]
+    columns = {'sub_id': np.repeat([sub_id for sub_id, _ in results], num_trials).astype(str),
+               'trial': np.concatenate([latencies['trial'] if 'trial' in latencies else np.arange(n)
+                                        for n, (_, latencies) in zip(num_trials, results)] + [[]]).astype(int)}
+    for name in (results[0][1] if results else []):
+        if name != 'trial':
+            columns[name] = np.concatenate([latencies[name] for _, latencies in results])
+    df = pd.DataFrame(columns)
+
+    if df_gt is not None:
+        df_gt = clean_ground_truth(df_gt)
+        on = ['sub_id', 'trial'] + (['channel'] if 'channel' in df and 'channel' in df_gt else [])
+        df = df.merge(df_gt[on + ['gt']], how='left', on=on, validate='one_to_one')
+
+    return df
+
+
+def clean_ground_truth(df_gt):
+    """Ground truth latencies saved by the ground truth app, one per trial. Trials removed in the app have a 'nan'
+    latency; when a trial was saved more than once, the last latency is used
+    :param df_gt: dataframe with the ground truth latency ('lat') of each 'sub_id' and 'trial' (and 'channel', for
+    multichannel recordings)
+    :return df_gt: dataframe with columns sub_id, trial, (channel) and gt (NaN for removed trials)
+    """
+    columns = ['sub_id', 'trial'] + (['channel'] if 'channel' in df_gt else [])
+    df_gt = pd.DataFrame({**{column: df_gt[column].astype(str if column == 'sub_id' else int) for column in columns},
+                          'gt': pd.to_numeric(df_gt['lat'], errors='coerce')})
+
+    return df_gt.drop_duplicates(columns, keep='last')
+
+
+def _kept_channel_trials(latencies, keep):
+    """Latencies of the kept trials of a multichannel recording, channel after channel
+    :param latencies: dict, for each method a NxC array of latencies
+    :param keep: boolean NxC array, trials kept in each channel
+    :return dict, for each method an array with the latency of each kept trial, plus channel and trial (index among
+    the kept trials of the channel)"""
+    kept = keep.T   # channel-major order
+    channel = np.broadcast_to(np.arange(keep.shape[1])[:, None], kept.shape)
+    trial = np.cumsum(kept, axis=1) - 1
+
+    return {'channel': channel[kept], 'trial': trial[kept],
+            **{method: latency.T[kept] for method, latency in latencies.items()}}
+
+
+def _run_subject(path, fs, options=(False, False, None, None, None, None)):
+    """process_subject returning (latencies, instrumentation report, None), or (None, instrumentation report, error
+    message) if it fails
+    :param options: profile and trace_memory of the Instrumentation, cache, dtype, filtering and continuous of
+    process_subject"""
+    profile, trace_memory, cache, dtype, filtering, continuous = options
+    instrumentation = Instrumentation(profile, trace_memory)
+    try:
+        return (process_subject(path, fs, instrumentation, cache, dtype, filtering, continuous),
+                instrumentation.report(), None)
+    except Exception as e:
+        return None, instrumentation.report(), f'{type(e).__name__}: {e}'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compute the latency of the MEPs of the recordings (EMG_data_SP.npy, '
+                                                 'MxN array, M samples, N trials, trigger at 1 s) found in a data '
+                                                 'folder, writing the results of each subject as it is processed')
+    parser.add_argument('data_dir', nargs='?', default='data', help='data folder, searched at any depth')
+    parser.add_argument('--fs', type=int, default=5000, help='EMG data sampling frequency (Hz)')
+    parser.add_argument('--output', default='latencies.csv',
+                        help='output csv file, or folder of parquet files if it ends with .parquet (requires pyarrow)')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue a previous run with the same output, skipping the subjects it finished')
+    parser.add_argument('--retry-failed', action='store_true', help='with --resume, process again the failed subjects')
+    parser.add_argument('--n-jobs', type=int, help='subjects processed in parallel (default: number of CPUs)')
+    parser.add_argument('--gt', help='ground truth file (csv with sub_id, trial and lat columns)')
+    parser.add_argument('--dataset', help='dataset (see dataset.py) to use instead of the recordings in data_dir')
+    parser.add_argument('--dtype', default='float64', choices=['float64', 'float32'],
+                        help='float32 halves the memory, with latencies equal up to round-off (see process_subject)')
+    parser.add_argument('--band', type=float, nargs=2, metavar=('LOW', 'HIGH'),
+                        help='band-pass filter the recordings between LOW and HIGH Hz before rejection and latency')
+    parser.add_argument('--notch', type=float, nargs='+', default=[], metavar='FREQ',
+                        help='remove these frequencies (e.g., line noise and harmonics) with notch filters')
+    parser.add_argument('--continuous', action='store_true',
+                        help='the EMG_data_SP.npy files are continuous recordings (samples, or samples x channels), '
+                             'epoched around their TMS triggers (see triggers.py)')
+    parser.add_argument('--channel', type=int, nargs='+',
+                        help='with --continuous, EMG channel(s) of multichannel recordings, searched for the artifacts')
+    parser.add_argument('--trigger-channel', type=int,
+                        help='with --continuous, channel with the trigger pulses (default: TMS artifacts in the EMG)')
+    parser.add_argument('--cache-dir', help="cache of the results of each subject (default: cache), '' to disable it")
+    parser.add_argument('--cache-size-mb', type=float, help='maximum size of the cache (default: 1024)')
+    parser.add_argument('--report', default='report.json',
+                        help='json report with time of each stage and failures of the methods')
+    parser.add_argument('--profile', action='store_true', help='add the functions taking most time to the report')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='add the peak memory allocated during each stage to the report')
+    parser.add_argument('--failure-rate-alert', type=float, default=0.5,
+                        help='warn if a method fails on a larger fraction of trials')
+    parser.add_argument('--evaluation', default='evaluation.csv',
+                        help='metrics of the methods against the ground truth')
+    parser.add_argument('--n-boot', type=int, default=2000,
+                        help='bootstrap replicates for the confidence intervals of the metrics')
+    args = parser.parse_args(argv)
+    if args.dataset:
+        # the epochs of a dataset were filtered when it was created (see create_dataframe.py), and its subjects are
+        # read from a single memory-mapped file, without cache
+        unused = [option for option, value in [('--band', args.band), ('--notch', args.notch),
+                                               ('--n-jobs', args.n_jobs), ('--cache-dir', args.cache_dir),
+                                               ('--cache-size-mb', args.cache_size_mb),
+                                               ('--continuous', args.continuous)] if value]
+        if unused:
+            parser.error(f'{", ".join(unused)} cannot be used with --dataset')
+    if not args.continuous and (args.channel is not None or args.trigger_channel is not None):
+        parser.error('--channel and --trigger-channel are only used with --continuous')
+
+    instrumentation = Instrumentation(args.profile, args.trace_memory)
+    df_gt = pd.read_csv(args.gt, dtype={'sub_id': str}) if args.gt else None
+    with ResultWriter(args.output, args.resume) as writer:
+        finished = writer.finished(args.retry_failed)
+        if args.dataset:
+            subjects = ((sub_id, latencies, None) for sub_id, latencies in process_dataset(args.dataset,
+                                                                                           instrumentation, finished,
+                                                                                           args.dtype))
+        else:
+            recordings = [(sub_id, path) for sub_id, path in find_recordings(args.data_dir) if sub_id not in finished]
+            print(f'{len(recordings)} subjects to process ({len(finished)} already processed)')
+            cache_dir = 'cache' if args.cache_dir is None else args.cache_dir
+            cache_size_mb = 1024 if args.cache_size_mb is None else args.cache_size_mb
+            cache = ResultCache(cache_dir, cache_size_mb) if cache_dir else None
+            filtering = {'band': tuple(args.band) if args.band else None, 'notch': tuple(args.notch)} \
+                if args.band or args.notch else None
+            continuous = None
+            if args.continuous:
+                channel = args.channel[0] if args.channel and len(args.channel) == 1 else args.channel
+                continuous = {'channel': channel, 'trigger_channel': args.trigger_channel}
+            subjects = iter_cohort(recordings, args.fs, args.n_jobs or os.cpu_count(), instrumentation, cache,
+                                   args.dtype, filtering, continuous)
+        for sub_id, latencies, error in subjects:
+            if error is None:
+                with instrumentation.stage('results'):
+                    try:
+                        writer.append(sub_id, results_dataframe([(sub_id, latencies)], df_gt))
+                    except ValueError as e:
+                        error = f'{type(e).__name__}: {e}'
+            if error is not None:
+                writer.fail(sub_id, error)
+        if writer.failed:
+            print(f'{len(writer.failed)} subjects could not be processed: {", ".join(writer.failed)}')
+        df = writer.read()
+
+    for method, method_failures in instrumentation.report()['failures'].items():
+        if method_failures['failure_rate'] > args.failure_rate_alert:
+            print(f'Warning: {method} did not find the latency of {100 * method_failures["failure_rate"]:.0f}% of '
+                  f'the trials {method_failures["reasons"]}')
+
+    # Compare all methods with the ground truth, overall and for each subject
+    if df_gt is not None and len(df):
+        with instrumentation.stage('evaluation'):
+            df_eval = evaluation.evaluate(df, n_boot=args.n_boot)
+        df_eval.to_csv(args.evaluation, index=False)
+        evaluation.print_evaluation(df_eval)
+
+    # saved last, so that it includes the time of the evaluation
+    instrumentation.save(args.report)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,23 +4,264 @@ Date: 23.06.2021
 Description: Function used for electromyography (EMG) pre-processing.
 """
 
+from functools import lru_cache
 import numpy as np
+from scipy import signal, stats
 
 
-def divide_in_epochs(input_signal, fs, t_time=1, t_min=-0.025, t_max=-0.05):
+def divide_in_epochs(input_signal, fs, t_time=1, t_min=-0.025, t_max=-0.05, sample_offset=0):
     """Divide the input_signal in epochs according to a trigger. They will be between tmin and tmax. Trigger is at
     t_time
-    :param input_signal: MxN array, M samples, N trials
+    :param input_signal: MxN array, M samples, N trials (or MxNxC array, C channels)
     :param fs: sampling frequency (Hz)
     :param t_time: time of trigger
     :param t_min: starting time of new epoch (related to trigger_t)
     :param t_max: ending time of new epoch (related to trigger_t)
+    :param sample_offset: index in the recording of the first sample of input_signal, when only part of the recording
+    was loaded (see load_epochs_windows)
     """
+    samp_t_min, samp_t_max = epoch_samples(fs, t_time, t_min, t_max)
+    epochs = input_signal[samp_t_min - sample_offset:samp_t_max - sample_offset]    # samples x trial
+
+    return epochs
+
+
+def epoch_samples(fs, t_time, t_min, t_max):
+    """First and last (excluded) samples in the recording of the epoch between t_min and t_max (see divide_in_epochs)
+    :return samp_t_min, samp_t_max: integers"""
     samp_t_min = int((t_time + t_min)*fs)
     samp_t_max = int((t_time + t_max) * fs)
-    epochs = input_signal[samp_t_min:samp_t_max]    # samples x trial
 
-    return epochs
+    return samp_t_min, samp_t_max
+
+
+def load_epochs_windows(path, fs, windows, t_time=1, dtype=None, sos=None, pad=None, chunk_size=256):
+    """Load from a .npy file (MxN array, M samples, N trials, or MxNxC array, C channels) only the samples needed by
+    the given epoch windows. The file is memory-mapped and only the samples from the beginning of the earliest window
+    to the end of the latest one are read, for all trials. If a filter is given, pad seconds of signal are also read
+    before and after them, to absorb the transients of the filter, and trials are read and filtered by chunks.
+    :param path: path to the .npy file
+    :param fs: sampling frequency (Hz)
+    :param windows: list of (t_min, t_max) tuples, as passed to divide_in_epochs
+    :param t_time: time of trigger
+    :param dtype: dtype of the returned epochs (e.g., 'float32'; default: the one of the file), converted while reading
+    :param sos: second-order sections of a zero-phase filter applied to the epochs (see filter_design), None for no
+    filtering
+    :param pad: seconds of signal read before and after the windows when filtering. Default: the time for the impulse
+    response of the filter to decay to 1e-3 (see filter_decay_samples), within the recording
+    :param chunk_size: number of trials filtered together
+    :return epochs: KxN (or KxNxC) array, K samples spanning all windows, N trials
+    :return sample_offset: index in the recording of the first sample of epochs, to pass to divide_in_epochs
+    """
+    samples = [epoch_samples(fs, t_time, t_min, t_max) for t_min, t_max in windows]
+    samp_start = min(samp_t_min for samp_t_min, _ in samples)
+    samp_stop = max(samp_t_max for _, samp_t_max in samples)
+    recording = np.load(path, mmap_mode='r')
+    if sos is None:
+        return np.array(recording[samp_start:samp_stop], dtype=dtype), samp_start
+
+    pad_samples = filter_decay_samples(sos) if pad is None else int(pad * fs)
+    pad_start = max(0, samp_start - pad_samples)
+    pad_stop = min(recording.shape[0], samp_stop + pad_samples)
+    if dtype is None:
+        dtype = recording.dtype if np.issubdtype(recording.dtype, np.floating) else float
+    epochs = np.empty((samp_stop - samp_start,) + recording.shape[1:], dtype=dtype)
+    for start in range(0, recording.shape[1], chunk_size):
+        trials = slice(start, start + chunk_size)
+        filtered = filter_epochs(np.asarray(recording[pad_start:pad_stop, trials], dtype=float), sos)
+        epochs[:, trials] = filtered[samp_start - pad_start:samp_stop - pad_start]
+
+    return epochs, samp_start
+
+
+@lru_cache(maxsize=None)
+def filter_design(fs, band=None, notch=(), order=4, quality=30):
+    """Second-order sections of a band-pass (Butterworth) filter followed by notch filters. Designs are cached, so
+    they are computed once per set of parameters
+    :param fs: sampling frequency (Hz)
+    :param band: (low, high) cut-off frequencies (Hz) of the band-pass filter, None for no band-pass
+    :param notch: frequencies (Hz) to remove with notch filters (e.g., line noise and its harmonics)
+    :param order: order of the band-pass filter
+    :param quality: quality factor of the notch filters
+    :return sos: Kx6 array (shared by the callers with the same parameters), None if there is no filter
+    """
+    sos = []
+    if band is not None:
+        sos.append(signal.butter(order, band, btype='bandpass', fs=fs, output='sos'))
+    for freq in notch:
+        sos.append(signal.tf2sos(*signal.iirnotch(freq, quality, fs=fs)))
+    if not sos:
+        return None
+
+    return np.concatenate(sos)
+
+
+def filter_decay_samples(sos, tol=1e-3):
+    """Number of samples after which the impulse response of a filter has decayed below tol (relative), from the
+    largest magnitude of its poles
+    :param sos: second-order sections of the filter (see filter_design)
+    :return integer"""
+    _, poles, _ = signal.sos2zpk(sos)
+    radius = np.max(abs(poles)) if len(poles) else 0
+    if radius == 0:
+        return 0
+
+    return int(np.ceil(np.log(tol) / np.log(radius)))
+
+
+def filter_epochs(input_signal, sos):
+    """Zero-phase filtering (forward and backward) of all trials along the sample axis. To limit memory, filter large
+    arrays by chunks of trials (as load_epochs_windows does while reading them)
+    :param input_signal: MxN array, M samples, N trials (or MxNxC array, C channels)
+    :param sos: second-order sections of the filter (see filter_design)
+    :return filtered: array with the shape and dtype of input_signal
+    """
+    return signal.sosfiltfilt(sos, input_signal, axis=0).astype(input_signal.dtype, copy=False)
+
+
+def longest_runs(mask, stop=None):
+    """Find the longest run of consecutive True values of each trial (the first one if there are several). The length
+    of the run ending at each sample is obtained from the cumulative count of True values, minus its value at the last
+    False sample, so that all trials are processed at once.
+    :param mask: boolean MxN array, M samples, N trials (or 1D array of M samples)
+    :param stop: only samples before stop are considered; integer or array of N integers
+    :return run_start: array of N integers, first sample of the longest run of each trial
+    :return run_len: array of N integers, length of the longest run of each trial (0 if mask is all False)
+    """
+    if mask.shape[0] == 0:
+        return np.zeros(mask.shape[1:], dtype=int), np.zeros(mask.shape[1:], dtype=int)
+    if stop is not None:
+        samples = np.arange(mask.shape[0]).reshape((-1,) + (1,) * (mask.ndim - 1))
+        mask = mask & (samples < stop)
+    count = np.cumsum(mask, axis=0)
+    count_at_false = np.maximum.accumulate(np.where(mask, 0, count), axis=0)
+    run_len_end = count - count_at_false    # length of the run ending at each sample
+    run_end = np.argmax(run_len_end, axis=0)
+    run_len = np.max(run_len_end, axis=0)
+
+    return run_end - run_len + 1, run_len
+
+
+class BaselineStats:
+    """Cumulative sums of the samples x, x^2, |x| and ||x_i+1| - |x_i|| of a signal (MxN array, M samples, N trials,
+    MxNxC array, C channels, or M samples of a single trial), from which the mean, standard deviation, rectified mean
+    and rectified mean consecutive difference (MCD) of any epoch within the signal are obtained in constant time.
+    Values are shifted by the first sample of each trial to limit round-off errors; statistics match the numpy ones up
+    to round-off. Sums are accumulated in float64 and stored with the dtype of the signal (float32 signals use half the
+    memory)
+    """
+    def __init__(self, input_signal, fs, t_time=1, sample_offset=0):
+        """
+        :param input_signal: MxN array, M samples, N trials (or MxNxC array, or 1D array of M samples)
+        :param fs: sampling frequency (Hz)
+        :param t_time: time of trigger
+        :param sample_offset: index in the recording of the first sample of input_signal
+        """
+        self.fs = fs
+        self.t_time = t_time
+        self.sample_offset = sample_offset
+
+        x = np.asarray(input_signal)
+        if not np.issubdtype(x.dtype, np.floating):
+            x = x.astype(float)
+        self.sum, self.sum_sq, self.sum_abs = (np.zeros((x.shape[0] + 1,) + x.shape[1:], dtype=x.dtype)
+                                               for _ in range(3))
+        self.sum_abs_diff = np.zeros(x.shape, dtype=x.dtype)
+        self.ref, self.ref_abs = (np.zeros(x.shape[1:], dtype=x.dtype) for _ in range(2))
+        self.update(x)
+
+    def update(self, input_signal, work=None):
+        """Recompute the sums for a new signal of the same shape, in the arrays already allocated (e.g., for each
+        trigger of a stream)
+        :param input_signal: array with the shape of the signal given when creating the instance
+        :param work: array with the shape and dtype of the signal, for intermediate values (allocated if None)
+        """
+        x = np.asarray(input_signal)
+        work = np.empty(self.sum_abs_diff.shape, dtype=self.sum.dtype) if work is None else work
+        self.ref[...] = x[0]
+        np.abs(self.ref, out=self.ref_abs)
+        np.subtract(x, self.ref, out=work)
+        self._cumsum(work, self.sum)
+        np.square(work, out=work)
+        self._cumsum(work, self.sum_sq)
+        # first differences of the rectified signal are written in place of their cumulative sum
+        np.abs(x, out=work)
+        np.subtract(work[1:], work[:-1], out=self.sum_abs_diff[1:])
+        np.abs(self.sum_abs_diff[1:], out=self.sum_abs_diff[1:])
+        self._cumsum(self.sum_abs_diff[1:], self.sum_abs_diff)
+        np.subtract(work, self.ref_abs, out=work)
+        self._cumsum(work, self.sum_abs)
+
+    @staticmethod
+    def _cumsum(x, out):
+        """Cumulative sum along axis 0 written to out, starting from 0 (out[i] is the sum of the first i samples). x
+        may be out[1:]"""
+        out[0] = 0
+        if out.dtype == np.float64 or out.ndim == 1:
+            np.cumsum(x, axis=0, dtype=np.float64, out=out[1:])
+        else:
+            # accumulate in float64 by blocks of trials (about 64k values each), so that the float64 temporary arrays do
+            # not cancel the memory saved by a smaller dtype
+            step = max(1, 2**16 // max(1, out.size // out.shape[1]))
+            for start in range(0, out.shape[1], step):
+                np.cumsum(x[:, start:start + step], axis=0, dtype=np.float64, out=out[1:, start:start + step])
+
+    def _samples(self, t_min, t_max):
+        """First and last (excluded) samples of the epoch in input_signal (see divide_in_epochs)"""
+        samp_t_min, samp_t_max = epoch_samples(self.fs, self.t_time, t_min, t_max)
+
+        return samp_t_min - self.sample_offset, samp_t_max - self.sample_offset
+
+    def mean(self, t_min, t_max):
+        """Mean of each trial in the epoch between t_min and t_max (see divide_in_epochs)"""
+        start, stop = self._samples(t_min, t_max)
+
+        return self.ref + (self.sum[stop] - self.sum[start]) / (stop - start)
+
+    def std(self, t_min, t_max):
+        """Standard deviation of each trial in the epoch between t_min and t_max"""
+        start, stop = self._samples(t_min, t_max)
+        mean_shifted = (self.sum[stop] - self.sum[start]) / (stop - start)
+        var = (self.sum_sq[stop] - self.sum_sq[start]) / (stop - start) - mean_shifted**2
+
+        return np.sqrt(np.maximum(var, 0))
+
+    def rectified_mean(self, t_min, t_max):
+        """Mean of the rectified signal (|x|) of each trial in the epoch between t_min and t_max"""
+        start, stop = self._samples(t_min, t_max)
+
+        return self.ref_abs + (self.sum_abs[stop] - self.sum_abs[start]) / (stop - start)
+
+    def rectified_mcd(self, t_min, t_max):
+        """Mean consecutive difference (mean of the absolute first differences) of the rectified signal of each trial
+        in the epoch between t_min and t_max"""
+        start, stop = self._samples(t_min, t_max)
+
+        return (self.sum_abs_diff[stop - 1] - self.sum_abs_diff[start]) / (stop - start - 1)
+
+    def pooled_mean_std(self, t_min, t_max, trials=None):
+        """Mean and standard deviation of the epoch between t_min and t_max pooling all the trials together (i.e., as
+        np.mean and np.std of the MxN epoch). For MxNxC signals, the trials of each channel are pooled separately
+        :param trials: trials to pool (boolean mask or indices of the N trials, or boolean NxC mask selecting different
+        trials in each channel), default all"""
+        start, stop = self._samples(t_min, t_max)
+        num_samples = stop - start
+        sum_shifted = self.sum[stop] - self.sum[start]
+        sum_sq_shifted = self.sum_sq[stop] - self.sum_sq[start]
+        ref = self.ref
+        weights = 1
+        if trials is not None and np.ndim(trials) > 1:
+            weights = np.asarray(trials, dtype=float)
+        elif trials is not None:
+            sum_shifted, sum_sq_shifted, ref = sum_shifted[trials], sum_sq_shifted[trials], ref[trials]
+        num_trials = np.sum(weights * np.ones(np.shape(sum_shifted)), axis=0) if np.ndim(sum_shifted) else 1
+
+        mean = np.sum(weights * (ref * num_samples + sum_shifted), axis=0) / (num_samples * num_trials)
+        # sum of squared deviations from the pooled mean, from the ones of each trial from its reference
+        ref_dev = ref - mean
+        sum_sq_dev = np.sum(weights * (sum_sq_shifted + 2 * ref_dev * sum_shifted + num_samples * ref_dev**2), axis=0)
+
+        return mean, np.sqrt(sum_sq_dev / (num_samples * num_trials))
 
 
 def correlation_bigger_than(input_signal_1, input_signal_2, thr=0.3):
@@ -66,10 +307,62 @@ def bigger_than(num, thr=0):
 
 def peak_to_peak_amplitude(input_signal):
     """Compute peak to peak amplitude in signal; i.e. max - min
-    :param input_signal MxN array, M samples, N trials
-    :return peak_to_peak float"""
+    :param input_signal MxN array, M samples, N trials (or MxNxC array, C channels)
+    :return peak_to_peak float, or array of N (NxC) amplitudes"""
     min_v = np.min(input_signal, axis=0)
     max_v = np.max(input_signal, axis=0)
     peak_to_peak = max_v - min_v
 
     return peak_to_peak
+
+
+def correlation_with_average(input_signal):
+    """Correlation coefficient between each trial and the average of all trials (of the same channel)
+    :param input_signal: MxN array, M samples, N trials (or MxNxC array, C channels)
+    :return corr_val: array of N (NxC) correlation coefficients (NaN for constant trials)"""
+    centered = input_signal - np.mean(input_signal, axis=0)
+    average = np.mean(input_signal, axis=1)
+    average_centered = average - np.mean(average, axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        corr_val = np.einsum('m...,mn...->n...', average_centered, centered) / \
+            np.sqrt(np.sum(centered**2, axis=0) * np.sum(average_centered**2, axis=0))
+
+    return corr_val
+
+
+def baseline_power_failures(epochs_baseline):
+    """Trials failing the baseline criterion of reject_trials: at least half of the rectified baseline is not above the
+    75th percentile + 3 IQR of the baseline power
+    :param epochs_baseline: KxN array, K samples, N trials (or KxNxC array, C channels)
+    :return boolean array (N, or NxC), True for trials failing the criterion"""
+    epoch_power = abs(epochs_baseline)**2
+    thr_power_baseline = np.percentile(epoch_power, 75, axis=0) + 3 * stats.iqr(epoch_power, axis=0)
+    samples_above_limit = np.sum(abs(epochs_baseline) > thr_power_baseline, axis=0)
+
+    return samples_above_limit < epochs_baseline.shape[0]/2
+
+
+def reject_trials(epochs_mep, epochs_baseline, thr_corr=0.3, ptp_percentile=25, criteria=('corr',)):
+    """Automatic rejection of trials, computed for all trials at once, based on (a) each MEP correlation with the
+    average MEP, (b) the magnitude of the MEP and (c) the baseline power, where a trial fails if at least half of its
+    rectified baseline is not above the 75th percentile + 3 IQR of its power (Hussain et al., 2019)
+    :param epochs_mep: MxN array, M samples, N trials (or MxNxC array, C channels, each rejected independently)
+    :param epochs_baseline: KxN array, K samples, N trials (or KxNxC array)
+    :param thr_corr: trials whose correlation with the average MEP is not above thr_corr fail criterion 'corr'
+    :param ptp_percentile: trials whose peak-to-peak amplitude is not above this percentile (across trials) of the
+    peak-to-peak amplitudes fail criterion 'small_mep'
+    :param criteria: criteria used to reject trials, among 'corr', 'small_mep' and 'baseline'. The default only uses
+    the correlation, which is the selection used for the ground truth dataframe (create_dataframe.py)
+    :return keep: boolean array (N, or NxC), True for trials passing all the criteria
+    :return reasons: dict, for each criterion a boolean array (N, or NxC), True for trials failing it
+    """
+    ptp = peak_to_peak_amplitude(epochs_mep)
+
+    reasons = {'corr': ~(correlation_with_average(epochs_mep) > thr_corr),
+               'small_mep': ~(ptp > np.percentile(ptp, ptp_percentile, axis=0)),
+               'baseline': baseline_power_failures(epochs_baseline)}
+    keep = np.ones(epochs_mep.shape[1:], dtype=bool)
+    for criterion in criteria:
+        keep &= ~reasons[criterion]
+
+    return keep, reasons
@@ -0,0 +1,172 @@
+"""
+Date: 17.10.2026
+Description: Append-only output of the latencies, written subject by subject as they are computed, with a checkpoint
+recording the finished subjects so that an interrupted run can be resumed. The output is a csv file, or a folder of
+parquet files (if its name ends with .parquet; requires pyarrow) to which a file is added every flush_rows rows.
+The checkpoint (output name + .checkpoint) has one json line per finished subject, written after its rows are on disk:
+rows written after the last checkpoint line (i.e., by a run that crashed) are discarded when resuming.
+"""
+import glob
+import json
+import os
+import shutil
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:     # only needed for parquet output
+    pa = pq = None
+
+
+class ResultWriter:
+    """Write the results of each subject (a dataframe, see main.results_dataframe) to the output"""
+    def __init__(self, path, resume=False, flush_rows=100000):
+        """
+        :param path: output csv file, or folder of parquet files if path ends with .parquet
+        :param resume: if True, keep the subjects of the checkpoint of a previous run; otherwise start a new output
+        :param flush_rows: rows buffered before a parquet file is written
+        """
+        self.path = path
+        self.parquet = path.endswith('.parquet')
+        if self.parquet and pq is None:
+            raise ImportError('pyarrow is needed to write parquet files')
+        self.checkpoint_path = f'{path}.checkpoint'
+        self.flush_rows = flush_rows
+        self.done = set()       # subjects whose results are in the output
+        self.failed = {}        # error of each subject that could not be processed
+        self.columns = None     # columns of the output, set by the first subject
+        self._buffer = []       # dataframes not written yet (parquet)
+        self._buffered_subjects = []
+
+        records = self._read_checkpoint() if resume else []
+        if not resume:
+            for output in (path, self.checkpoint_path):
+                if os.path.isdir(output):
+                    shutil.rmtree(output)
+                elif os.path.exists(output):
+                    os.remove(output)
+        for record in records:
+            if record['status'] == 'done':
+                self.done.add(record['sub_id'])
+                self.failed.pop(record['sub_id'], None)
+            else:
+                self.failed[record['sub_id']] = record['error']
+
+        if self.parquet:
+            # files written after the last checkpoint line are discarded
+            parts = {record['part'] for record in records if record['status'] == 'done'}
+            os.makedirs(path, exist_ok=True)
+            for part in glob.glob(os.path.join(path, '*')):
+                if os.path.basename(part) not in parts:
+                    os.remove(part)
+            self._num_parts = len(parts)
+            self._file = None
+            if parts:
+                self.columns = pq.read_schema(os.path.join(path, min(parts))).names
+        else:
+            offset = max([record['offset'] for record in records if record['status'] == 'done'], default=0)
+            self._file = open(path, 'a+b')
+            if os.path.getsize(path) < offset:
+                raise ValueError(f'{path} is shorter than recorded in {self.checkpoint_path}')
+            self._file.truncate(offset)
+            if offset:
+                self.columns = list(pd.read_csv(path, nrows=0).columns)
+        # the checkpoint is rewritten without a line cut by a crash, then appended to
+        with open(self.checkpoint_path, 'w') as f:
+            f.writelines(json.dumps(record) + '\n' for record in records)
+        self._checkpoint = open(self.checkpoint_path, 'a')
+
+    def finished(self, retry_failed=False):
+        """Subjects not to process again
+        :param retry_failed: if True, the subjects that failed are not included
+        :return set of sub_id"""
+        return self.done if retry_failed else self.done | set(self.failed)
+
+    def append(self, sub_id, df):
+        """Add the results of a subject
+        :param sub_id: subject id
+        :param df: dataframe with the results, with the same columns for all subjects"""
+        if self.columns is None:
+            self.columns = list(df.columns)
+        elif list(df.columns) != self.columns:
+            raise ValueError(f'Results of {sub_id} have columns {list(df.columns)} instead of {self.columns}')
+        if self.parquet:
+            self._buffer.append(df)
+            self._buffered_subjects.append(sub_id)
+            if sum(len(df_sub) for df_sub in self._buffer) >= self.flush_rows:
+                self.flush()
+        else:
+            self._file.seek(0, os.SEEK_END)
+            self._file.write(df.to_csv(header=self._file.tell() == 0, index=False).encode())
+            self._sync(self._file)
+            self._record({'sub_id': sub_id, 'status': 'done', 'offset': self._file.tell()})
+        self.failed.pop(sub_id, None)
+
+    def fail(self, sub_id, error):
+        """Record a subject that could not be processed"""
+        self.failed[sub_id] = error
+        self._record({'sub_id': sub_id, 'status': 'failed', 'error': error})
+
+    def flush(self):
+        """Write the buffered results (parquet)"""
+        if not self._buffer:
+            return
+        part = f'part-{self._num_parts:05d}.parquet'
+        tmp_path = os.path.join(self.path, f'.{part}.tmp')
+        pq.write_table(pa.Table.from_pandas(pd.concat(self._buffer), preserve_index=False), tmp_path)
+        os.replace(tmp_path, os.path.join(self.path, part))
+        self._num_parts += 1
+        for sub_id in self._buffered_subjects:
+            self._record({'sub_id': sub_id, 'status': 'done', 'part': part})
+        self._buffer, self._buffered_subjects = [], []
+
+    def close(self):
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+        self._checkpoint.close()
+
+    def read(self):
+        """All the results in the output, including the buffered ones (which are written first)
+        :return dataframe"""
+        if self.parquet:
+            self.flush()
+            return pd.read_parquet(self.path) if self._num_parts else pd.DataFrame()
+        if not os.path.getsize(self.path):
+            return pd.DataFrame()
+
+        return pd.read_csv(self.path, dtype={'sub_id': str})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _record(self, record):
+        """Add a line to the checkpoint"""
+        self.done.discard(record['sub_id'])
+        if record['status'] == 'done':
+            self.done.add(record['sub_id'])
+        self._checkpoint.write(json.dumps(record) + '\n')
+        self._sync(self._checkpoint)
+
+    def _read_checkpoint(self):
+        """Records of the checkpoint, without a last line cut by a crash"""
+        if not os.path.exists(self.checkpoint_path):
+            return []
+        records = []
+        with open(self.checkpoint_path) as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break
+
+        return records
+
+    @staticmethod
+    def _sync(f):
+        f.flush()
+        os.fsync(f.fileno())
@@ -0,0 +1,225 @@
+"""
+Date: 17.10.2026
+Description: Online detection of MEP latency and peak-to-peak amplitude on a stream of EMG samples (e.g., to drive
+closed-loop TMS), and simulation of such a stream from a EMG_data_SP.npy recording.
+"""
+import sys
+import time
+from collections import deque
+import numpy as np
+
+import preprocessing as pp
+from epoch_c import BASELINE_EPOCH
+
+
+class StreamingLatencyDetector:
+    """Detect the latency of the MEP following each trigger, as soon as the MEP window is complete. Incoming samples
+    are written in a ring buffer holding the pre-stimulus baseline and the MEP window. All buffers (ring, window,
+    baseline statistics and the masks of the latency methods) are allocated once, and the methods of Epoch are computed
+    in place on them, so neither ingesting samples nor detecting a latency allocates arrays, and each latency is
+    computed on a fixed-size window: the time from the last sample of the MEP window to the result is bounded.
+    """
+    def __init__(self, fs, methods=('latency_bigoni_method',), t_min=0.01, t_max=0.05, block_size=None,
+                 baseline_signals=None):
+        """
+        :param fs: sampling frequency (Hz)
+        :param methods: names of the Epoch latency methods to compute, in this order (as in Epoch, the methods that
+        flip the signal affect the next ones)
+        :param t_min: starting time of the MEP window (related to the trigger, in s)
+        :param t_max: ending time of the MEP window (related to the trigger, in s)
+        :param block_size: maximum number of samples written to the ring buffer at once (longer blocks are split),
+        default is the length of the MEP window
+        :param baseline_signals: baseline signals of previous trials, needed only by latency_method_hamada_1
+        """
+        if 'latency_method_hamada_1' in methods and baseline_signals is None:
+            raise ValueError('latency_method_hamada_1 needs baseline_signals')
+        self._methods = {'latency_bigoni_method': self._bigoni, 'latency_method_hamada_1': self._hamada_1,
+                         'latency_method_hamada_2': self._hamada_2, 'latency_method_huang': self._huang,
+                         'latency_method_garvey_revised': self._garvey, 'latency_method_daskalakis': self._daskalakis}
+        unknown = set(methods) - set(self._methods)
+        if unknown:
+            raise ValueError(f'Unknown latency methods {sorted(unknown)}')
+        self.fs = fs
+        self.methods = methods
+        self.baseline_signals = baseline_signals
+        # threshold of Hamada method 1, the same for all triggers
+        self.thr_hamada_1 = np.mean(baseline_signals) + 2 * np.std(baseline_signals) \
+            if baseline_signals is not None else None
+
+        # Window is defined as in an epoch with the trigger at 1 s (see pp.divide_in_epochs)
+        self.trigger_sample = pp.epoch_samples(fs, 1, 0, 0)[0]
+        self.window_start, baseline_stop = pp.epoch_samples(fs, 1, *BASELINE_EPOCH)
+        self.mep_start, self.mep_stop = pp.epoch_samples(fs, 1, t_min, t_max)
+        self.window = np.zeros(self.mep_stop - self.window_start)
+        self.block_size = block_size if block_size is not None else self.mep_stop - self.mep_start
+        self.ring = np.zeros(len(self.window) + self.block_size)
+
+        # statistics of the pre-stimulus epoch (as in Epoch), updated in place for each trigger
+        self._baseline = self.window[:baseline_stop - self.window_start]
+        self._work = np.empty(len(self._baseline))
+        self.baseline_stats = pp.BaselineStats(self._baseline, fs, 1, self.window_start)
+        # MEP window (flipped in place by the methods) and buffers of the methods
+        self.v = np.empty(self.mep_stop - self.mep_start)
+        self._abs = np.empty(len(self.v))
+        self._mask = np.empty(len(self.v), dtype=bool)
+        # runs of positive derivatives are counted in float arrays: casts from boolean would allocate buffers
+        self._positive = np.empty(len(self.v))
+        self._count = np.empty(len(self.v))
+        self._count_at_false = np.empty(len(self.v))
+
+        self.num_samples = 0    # number of samples received so far
+        self.pending = deque()  # triggers whose MEP window is not complete yet
+
+    def trigger(self, sample_index):
+        """Register a trigger (TMS pulse). Its latency is computed when its MEP window is complete, i.e., at once if
+        the samples of the window were all received already
+        :param sample_index: index of the trigger in the stream (counting from the first sample pushed). Triggers whose
+        MEP window is not complete must be registered in increasing order, as push detects them in that order
+        :return result: dict (see push) if the MEP window of the trigger is already complete, None otherwise
+        """
+        start = sample_index - self.trigger_sample + self.window_start
+        if sample_index - self.trigger_sample + self.mep_stop <= self.num_samples:
+            if start < self.num_samples - len(self.ring):
+                raise ValueError(f'Baseline of trigger at sample {sample_index} is no longer in the buffer')
+            return self._detect(sample_index)
+        if self.pending and sample_index < self.pending[-1]:
+            raise ValueError(f'Trigger at sample {sample_index} is registered after the trigger at sample '
+                             f'{self.pending[-1]}: triggers must be registered in increasing order')
+        self.pending.append(sample_index)
+
+    def push(self, block):
+        """Add samples to the stream
+        :param block: 1D array of new samples
+        :return results: list with a dict for each trigger whose MEP window was completed by block, with keys trigger,
+        ptp and one for each method (latency in samples from the beginning of the MEP window, NaN if not found)
+        """
+        results = []
+        for start in range(0, len(block), self.block_size):
+            piece = block[start:start + self.block_size]
+            ring_start = self.num_samples % len(self.ring)
+            first_part = min(len(piece), len(self.ring) - ring_start)
+            self.ring[ring_start:ring_start + first_part] = piece[:first_part]
+            self.ring[:len(piece) - first_part] = piece[first_part:]
+            self.num_samples += len(piece)
+
+            while self.pending and self.pending[0] - self.trigger_sample + self.mep_stop <= self.num_samples:
+                results.append(self._detect(self.pending.popleft()))
+
+        return results
+
+    def _detect(self, sample_index):
+        """Copy the window of the trigger at sample_index from the ring buffer and compute its latency"""
+        ring_start = (sample_index - self.trigger_sample + self.window_start) % len(self.ring)
+        first_part = min(len(self.window), len(self.ring) - ring_start)
+        self.window[:first_part] = self.ring[ring_start:ring_start + first_part]
+        self.window[first_part:] = self.ring[:len(self.window) - first_part]
+
+        self.baseline_stats.update(self._baseline, self._work)
+        self.v[:] = self.window[self.mep_start - self.window_start:]
+        result = {'trigger': sample_index, 'ptp': abs(self.v.max() - self.v.min())}
+        for method in self.methods:
+            result[method] = self._methods[method]()
+
+        return result
+
+    # Latency methods of Epoch, computed in place on self.v (NaN if the beginning of the MEP is not found)
+
+    def _flip_negative_first(self):
+        """Flip the signal if its negative deflection comes before the positive one (as done in Epoch)
+        :return p_peak: sample of the positive peak, after the flip"""
+        p_peak = self.v.argmax()
+        if p_peak > self.v.argmin():
+            np.negative(self.v, out=self.v)
+            p_peak = self.v.argmax()
+
+        return p_peak
+
+    @staticmethod
+    def _first(mask):
+        """First sample where mask is True, NaN if none"""
+        first = mask.argmax()
+        return first if mask[first] else np.nan
+
+    def _bigoni(self, min_len=4):
+        # beginning of the longest run of positive first derivatives before the positive peak (see pp.longest_runs)
+        p_peak = self._flip_negative_first()
+        if p_peak < 2:
+            return np.nan
+        num_diff = p_peak - 1
+        positive, count = self._positive[:num_diff], self._count[:num_diff]
+        count_at_false = self._count_at_false[:num_diff]
+        np.subtract(self.v[1:p_peak], self.v[:p_peak - 1], out=positive)
+        np.sign(positive, out=positive)
+        np.maximum(positive, 0, out=positive)      # 1 where the derivative is positive, 0 elsewhere
+        np.cumsum(positive, out=count)
+        np.subtract(1, positive, out=count_at_false)
+        np.multiply(count, count_at_false, out=count_at_false)
+        np.maximum.accumulate(count_at_false, out=count_at_false)
+        np.subtract(count, count_at_false, out=count)   # length of the run ending at each sample
+        run_end = count.argmax()
+        run_len = int(count[run_end])
+
+        return run_end - run_len + 1 if run_len - 2 > min_len else np.nan
+
+    def _hamada_1(self):
+        np.abs(self.v, out=self._abs)
+        return self._first(np.greater(self._abs, self.thr_hamada_1, out=self._mask))
+
+    def _hamada_2(self):
+        thr = self.baseline_stats.mean(-0.1, -0.002) + 2 * self.baseline_stats.std(-0.1, -0.002)
+        np.abs(self.v, out=self._abs)
+        return self._first(np.greater(self._abs, thr, out=self._mask))
+
+    def _huang(self):
+        thr = 5 * self.baseline_stats.std(-0.2, -0.002)
+        return self._first(np.greater(self.v, thr, out=self._mask))
+
+    def _garvey(self):
+        mcd = self.baseline_stats.rectified_mcd(-0.1, -0.002)
+        thr_low = self.baseline_stats.rectified_mean(-0.1, -0.002) - 2.66*mcd
+        return self._first(np.less_equal(self.v, thr_low, out=self._mask))
+
+    def _daskalakis(self):
+        thr = self._baseline[pp.epoch_samples(self.fs, 1, -0.04, -0.002)[0] - self.window_start:].mean()
+        p_peak = self._flip_negative_first()
+        if not p_peak:
+            return np.nan
+        # samples before the peak, from the last one: the first one above thr is the last crossing
+        mask = np.greater(self.v[p_peak - 1::-1], thr, out=self._mask[:p_peak])
+        last = mask.argmax()
+
+        return p_peak - 1 - last if mask[last] else np.nan
+
+
+def simulate_stream(path, fs, block_size):
+    """Replay a recording as an amplifier stream: trials are concatenated in time and sent in blocks of samples.
+    :param path: path to a .npy file (MxN array, M samples, N trials, trigger at 1 s)
+    :param fs: sampling frequency (Hz)
+    :param block_size: number of samples per block
+    :return: generator of (block, triggers) tuples, triggers being the stream indices of the triggers that are in
+    block
+    """
+    recording = np.load(path, mmap_mode='r')
+    num_samples, num_trials = recording.shape
+    triggers = np.arange(num_trials) * num_samples + pp.epoch_samples(fs, 1, 0, 0)[0]
+    for start in range(0, num_samples * num_trials, block_size):
+        idx_stream = np.arange(start, min(start + block_size, num_samples * num_trials))
+        block = recording[idx_stream % num_samples, idx_stream // num_samples]
+        yield block, triggers[(triggers >= start) & (triggers < start + block_size)]
+
+
+if __name__ == '__main__':
+    path = sys.argv[1]  # path to a EMG_data_SP.npy file
+    fs = 5000   # EMG data sampling frequency in Hz
+    block_size = 50     # samples per amplifier block (10 ms at 5 kHz)
+
+    detector = StreamingLatencyDetector(fs, methods=('latency_bigoni_method', 'latency_method_huang'))
+    delays = []
+    for block, triggers in simulate_stream(path, fs, block_size):
+        for trigger in triggers:
+            detector.trigger(trigger)   # triggers come before the end of their MEP window, no result yet
+        t_block = time.perf_counter()
+        for result in detector.push(block):
+            delays.append(time.perf_counter() - t_block)
+            print(result)
+    print(f'Delay from last block to result (ms): mean {1000 * np.mean(delays):.3f}, max {1000 * np.max(delays):.3f}')
@@ -0,0 +1,266 @@
+"""
+Date: 17.10.2026
+Description: Sweep of the parameters of trial rejection and latency methods, evaluated against the ground truth. The
+per-trial intermediates (epochs, correlations, baseline statistics, running maxima and minima of the MEPs, runs of
+positive derivatives) are computed once per subject and MEP window; the latencies for every value of a threshold are
+then obtained at once by comparing the thresholds with the running maxima/minima.
+Each method only depends on its own parameter, so the grid is swept method by method (not as a full product):
+- min_len: minimum length of the positive chunk of the Bigoni method
+- hamada_k: number of SDs above the mean of the Hamada methods (1 and 2)
+- huang_k: number of SDs of the Huang method
+- garvey_k: number of MCDs below the rectified mean of the Garvey method
+- thr_corr, ptp_percentile, baseline_window: trial rejection (see pp.reject_trials; ptp_percentile and baseline_window
+  only matter if 'small_mep' and 'baseline' are among the criteria)
+- mep_window: window of the MEP (related to the trigger, in s)
+- hamada1_window, hamada2_window, huang_window, garvey_window, daskalakis_window: pre-stimulus window of the baseline
+  of each method (related to the trigger, in s); each window is swept with every value of the parameter of its method
+Latencies are given from the beginning of the default MEP window whatever mep_window, so that they compare with the
+ground truth. Ground truth exists only for trials kept by the default rejection, so only those are evaluated.
+"""
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+import numpy as np
+import pandas as pd
+
+import evaluation
+import preprocessing as pp
+from epoch_c import BASELINE_EPOCH, EpochBatch
+from main import WINDOWS, clean_ground_truth
+
+MEP_WINDOW = (0.01, 0.05)
+BASELINE_WINDOW = (-0.025, -0.005)
+DEFAULT_GRID = {'min_len': [4], 'hamada_k': [2], 'huang_k': [5], 'garvey_k': [2.66], 'thr_corr': [0.3],
+                'ptp_percentile': [25], 'baseline_window': [BASELINE_WINDOW], 'mep_window': [MEP_WINDOW],
+                'hamada1_window': [(-0.2, -0.02)], 'hamada2_window': [(-0.1, -0.002)], 'huang_window': [(-0.2, -0.002)],
+                'garvey_window': [(-0.1, -0.002)], 'daskalakis_window': [(-0.04, -0.002)]}
+METHOD_PARAMETERS = {'lat_bigoni': 'min_len', 'lat_hamada1': 'hamada_k', 'lat_hamada2': 'hamada_k',
+                     'lat_garvey': 'garvey_k', 'lat_huang': 'huang_k', 'lat_daskalakis': None}
+METHOD_WINDOWS = {'lat_bigoni': None, 'lat_hamada1': 'hamada1_window', 'lat_hamada2': 'hamada2_window',
+                  'lat_garvey': 'garvey_window', 'lat_huang': 'huang_window', 'lat_daskalakis': 'daskalakis_window'}
+
+
+class SubjectIntermediates:
+    """Per-trial intermediates of all the trials of one subject, for one MEP window"""
+    def __init__(self, epochs_emg, fs, t_time=1, sample_offset=0, mep_window=MEP_WINDOW, method_windows=()):
+        """
+        :param epochs_emg: MxN array, M samples, N trials, including the MEP window and the pre-stimulus epochs
+        :param fs: sampling frequency (Hz)
+        :param t_time: time of trigger
+        :param sample_offset: index in the recording of the first sample of epochs_emg
+        :param mep_window: (t_min, t_max) of the MEP
+        :param method_windows: baseline windows of the methods, if some lie outside of epoch_c.BASELINE_EPOCH
+        """
+        self.epochs_emg = epochs_emg
+        self.fs = fs
+        self.t_time = t_time
+        self.sample_offset = sample_offset
+        epochs_mep = pp.divide_in_epochs(epochs_emg, fs, t_time, *mep_window, sample_offset)
+        # shift of the latencies to the beginning of the default MEP window
+        self.shift = pp.epoch_samples(fs, t_time, *mep_window)[0] - pp.epoch_samples(fs, t_time, *MEP_WINDOW)[0]
+
+        # rejection
+        self.corr = pp.correlation_with_average(epochs_mep)
+        self.ptp = pp.peak_to_peak_amplitude(epochs_mep)
+        self._baseline_failures = {}
+
+        # baseline statistics of a pre-stimulus epoch containing the windows of all methods (the one of EpochBatch
+        # for the default windows)
+        t_min = min([BASELINE_EPOCH[0]] + [window[0] for window in method_windows])
+        t_max = max([BASELINE_EPOCH[1]] + [window[1] for window in method_windows])
+        epochs_baseline = pp.divide_in_epochs(epochs_emg, fs, t_time, t_min, t_max, sample_offset)
+        self.baseline_stats = pp.BaselineStats(epochs_baseline, fs, t_time, pp.epoch_samples(fs, t_time, t_min,
+                                                                                            t_max)[0])
+
+        # latency methods, in the order of EpochBatch.latency_all_methods (Bigoni flips the trials used by the others)
+        self.epochs = EpochBatch(epochs_mep, epochs_emg, fs, t_time, sample_offset, self.baseline_stats)
+        p_peak = self.epochs._flip_negative_first()
+        self.run_start, self.run_len = pp.longest_runs(np.diff(self.epochs.v, axis=0) > 0, stop=p_peak - 1)
+        self.cummax_abs = np.maximum.accumulate(abs(self.epochs.v), axis=0)
+        self.cummax = np.maximum.accumulate(self.epochs.v, axis=0)
+        self.cummin = np.minimum.accumulate(self.epochs.v, axis=0)
+        self._lat_daskalakis = {}
+
+    def keep(self, thr_corr, ptp_percentile, baseline_window, criteria=('corr',)):
+        """Trials kept by the rejection (see pp.reject_trials)
+        :return boolean array (N)"""
+        reasons = {}
+        if 'corr' in criteria:
+            reasons['corr'] = ~(self.corr > thr_corr)
+        if 'small_mep' in criteria:
+            reasons['small_mep'] = ~(self.ptp > np.percentile(self.ptp, ptp_percentile))
+        if 'baseline' in criteria:
+            if baseline_window not in self._baseline_failures:
+                epochs_baseline = pp.divide_in_epochs(self.epochs_emg, self.fs, self.t_time, *baseline_window,
+                                                      self.sample_offset)
+                self._baseline_failures[baseline_window] = pp.baseline_power_failures(epochs_baseline)
+            reasons['baseline'] = self._baseline_failures[baseline_window]
+        keep = np.ones(len(self.corr), dtype=bool)
+        for criterion in criteria:
+            keep &= ~reasons[criterion]
+
+        return keep
+
+    def latencies(self, method, values, keep, window=None):
+        """Latencies of the kept trials for every value of the parameter of a method
+        :param method: name of the method (key of METHOD_PARAMETERS)
+        :param values: values of its parameter (ignored for lat_daskalakis)
+        :param keep: trials kept by the rejection (used to pool the baseline of Hamada method 1)
+        :param window: (t_min, t_max) of the baseline of the method (ignored for lat_bigoni). Default: the one of
+        DEFAULT_GRID
+        :return latencies: array of (kept trials) x (values) latencies, from the beginning of the default MEP window
+        """
+        stats = self.baseline_stats
+        k = np.asarray(values, dtype=float)[None]
+        if window is None and METHOD_WINDOWS.get(method):
+            window = DEFAULT_GRID[METHOD_WINDOWS[method]][0]
+        if method == 'lat_bigoni':
+            latency = np.where(self.run_len[:, None] - 2 > k, self.run_start[:, None], np.nan)
+        elif method == 'lat_hamada1':
+            mean, std = stats.pooled_mean_std(*window, keep)
+            latency = _first_crossing(self.cummax_abs[:, :, None] <= mean + k * std)
+        elif method == 'lat_hamada2':
+            thr = stats.mean(*window)[:, None] + k * stats.std(*window)[:, None]
+            latency = _first_crossing(self.cummax_abs[:, :, None] <= thr)
+        elif method == 'lat_huang':
+            thr = k * stats.std(*window)[:, None]
+            latency = _first_crossing(self.cummax[:, :, None] <= thr)
+        elif method == 'lat_garvey':
+            thr_low = stats.rectified_mean(*window)[:, None] - k * stats.rectified_mcd(*window)[:, None]
+            latency = _first_crossing(self.cummin[:, :, None] > thr_low)
+        elif method == 'lat_daskalakis':
+            if window not in self._lat_daskalakis:
+                self._lat_daskalakis[window] = self.epochs.latency_method_daskalakis(*window)
+            latency = self._lat_daskalakis[window][:, None]
+        else:
+            raise ValueError(f'Unknown method {method}')
+
+        return latency[keep] + self.shift
+
+
+def sweep_subject(epochs_emg, fs, gt, grid=None, criteria=('corr',), t_time=1, sample_offset=0):
+    """Latencies of one subject for every configuration of the grid, on the trials with a ground truth latency
+    :param epochs_emg: MxN array, M samples, N trials (all the trials of the recording)
+    :param fs: sampling frequency (Hz)
+    :param gt: array of N ground truth latencies (NaN for trials without ground truth)
+    :param grid: dict, parameter -> list of values (missing parameters are taken from DEFAULT_GRID)
+    :param criteria: criteria of the rejection
+    :param t_time: time of trigger
+    :param sample_offset: index in the recording of the first sample of epochs_emg
+    :return results: dict, (mep_window, baseline_window, thr_corr, ptp_percentile, method, window) -> (latencies
+    (trials x values), gt) of the kept trials with ground truth; window is the baseline window of the method (None for
+    lat_bigoni)
+    """
+    grid = {**DEFAULT_GRID, **(grid or {})}
+    method_windows = [tuple(window) for parameter in METHOD_WINDOWS.values() if parameter
+                      for window in grid[parameter]]
+    results = {}
+    for mep_window in grid['mep_window']:
+        intermediates = SubjectIntermediates(epochs_emg, fs, t_time, sample_offset, tuple(mep_window), method_windows)
+        for baseline_window, thr_corr, ptp_percentile in itertools.product(grid['baseline_window'], grid['thr_corr'],
+                                                                          grid['ptp_percentile']):
+            keep = intermediates.keep(thr_corr, ptp_percentile, tuple(baseline_window), criteria)
+            if not keep.any():
+                continue
+            has_gt = ~np.isnan(gt[keep])
+            for method, parameter in METHOD_PARAMETERS.items():
+                values = grid[parameter] if parameter else [None]
+                windows = [tuple(window) for window in grid[METHOD_WINDOWS[method]]] if METHOD_WINDOWS[method] \
+                    else [None]
+                for window in windows:
+                    latencies = intermediates.latencies(method, values, keep, window)
+                    results[(tuple(mep_window), tuple(baseline_window), thr_corr, ptp_percentile, method, window)] = \
+                        (latencies[has_gt], gt[keep][has_gt])
+
+    return results
+
+
+def sweep(data_dir, fs, df_gt, grid=None, criteria=('corr',), n_jobs=1, n_boot=0, seed=0):
+    """Evaluate every configuration of the grid on the subjects of data_dir with a ground truth
+    :param data_dir: path to the data folder (one folder per subject, containing EMG_data_SP.npy)
+    :param fs: sampling frequency (Hz)
+    :param df_gt: dataframe with the ground truth latency ('lat') of each 'sub_id' and 'trial' (index among the trials
+    kept by the default rejection, as in main.py)
+    :param grid: dict, parameter -> list of values (missing parameters are taken from DEFAULT_GRID)
+    :param criteria: criteria of the rejection
+    :param n_jobs: number of worker processes
+    :param n_boot: number of bootstrap replicates of the confidence intervals (0 for none)
+    :param seed: seed of the bootstrap
+    :return df_sweep: dataframe with one row per configuration, method and value of its parameter, with the metrics
+    of evaluation.evaluate
+    """
+    grid = {**DEFAULT_GRID, **(grid or {})}
+    df_gt = clean_ground_truth(df_gt)
+    subjects = sorted(sub_id for sub_id in df_gt['sub_id'].unique() if os.path.isdir(os.path.join(data_dir, sub_id)))
+    paths = [os.path.join(data_dir, sub_id, 'EMG_data_SP.npy') for sub_id in subjects]
+    gt_subjects = [df_gt[df_gt['sub_id'] == sub_id] for sub_id in subjects]
+
+    pooled = {}
+    with ProcessPoolExecutor(max_workers=n_jobs) if n_jobs > 1 else nullcontext() as executor:
+        mapper = executor.map if n_jobs > 1 else map
+        for sub_id, results in zip(subjects, mapper(_sweep_file, paths, [fs] * len(paths), gt_subjects,
+                                                    [grid] * len(paths), [criteria] * len(paths))):
+            print(f'subject: {sub_id}')
+            for key, values in results.items():
+                pooled.setdefault(key, []).append(values)
+
+    rng = np.random.default_rng(seed)
+    rows = []
+    for (mep_window, baseline_window, thr_corr, ptp_percentile, method, window), values in pooled.items():
+        latencies = np.concatenate([latencies for latencies, _ in values])
+        gt = np.concatenate([gt for _, gt in values])
+        metrics = evaluation.error_metrics(latencies, gt, n_boot, rng=rng)
+        parameter = METHOD_PARAMETERS[method]
+        for idx_value, value in enumerate(grid[parameter] if parameter else [None]):
+            row = {'mep_window': mep_window, 'baseline_window': baseline_window, 'thr_corr': thr_corr,
+                   'ptp_percentile': ptp_percentile, 'method': method, 'window': window, 'parameter': parameter,
+                   'value': value, 'num_trials': len(gt)}
+            for metric, (estimate, low, high) in metrics.items():
+                row.update({metric: estimate[idx_value], f'{metric}_low': low[idx_value],
+                            f'{metric}_high': high[idx_value]})
+            rows.append(row)
+
+    return pd.DataFrame(rows)
+
+
+def _sweep_file(path, fs, df_gt_sub, grid, criteria):
+    """sweep_subject on a recording, with the ground truth of its trials (df_gt_sub, see sweep)"""
+    windows = WINDOWS + [tuple(w) for w in grid['mep_window']] + [tuple(w) for w in grid['baseline_window']] + \
+        [tuple(w) for parameter in METHOD_WINDOWS.values() if parameter for w in grid[parameter]]
+    epochs_emg, sample_offset = pp.load_epochs_windows(path, fs, windows)
+    # trials of the ground truth are numbered among the ones kept by the default rejection
+    epochs_mep = pp.divide_in_epochs(epochs_emg, fs, 1, *MEP_WINDOW, sample_offset)
+    epochs_baseline = pp.divide_in_epochs(epochs_emg, fs, 1, *BASELINE_WINDOW, sample_offset)
+    kept_default = np.flatnonzero(pp.reject_trials(epochs_mep, epochs_baseline)[0])
+    df_gt_sub = df_gt_sub[df_gt_sub['trial'] < len(kept_default)]
+    gt = np.full(epochs_emg.shape[1], np.nan)
+    gt[kept_default[df_gt_sub['trial'].values]] = df_gt_sub['gt'].values
+
+    return sweep_subject(epochs_emg, fs, gt, grid, criteria, 1, sample_offset)
+
+
+def _first_crossing(not_crossed):
+    """First sample (axis 0) of each trial and threshold where the threshold is crossed, given a boolean array that is
+    True before the crossing (e.g., running maximum <= threshold); NaN where it is never crossed"""
+    first = np.sum(not_crossed, axis=0)
+
+    return np.where(first < not_crossed.shape[0], first, np.nan)
+
+
+if __name__ == '__main__':
+    data_dir = 'data'   # Insert here the path to your data folder
+    fs = 5000   # EMG data sampling frequency in Hz
+    n_jobs = os.cpu_count()     # number of subjects processed in parallel
+    gt_file = 'gt.csv'  # path to the ground truth file (csv with sub_id, trial and lat columns)
+    sweep_file = 'sweep.csv'    # metrics of each configuration
+    grid = {'min_len': [2, 3, 4, 5, 6, 8],
+            'hamada_k': [1.5, 2, 2.5, 3],
+            'huang_k': [3, 4, 5, 6],
+            'garvey_k': [2, 2.66, 3],
+            'thr_corr': [0.2, 0.3, 0.4]}
+
+    df_sweep = sweep(data_dir, fs, pd.read_csv(gt_file, dtype={'sub_id': str}), grid, n_jobs=n_jobs)
+    df_sweep.to_csv(sweep_file, index=False)
+    print(df_sweep[['thr_corr', 'method', 'window', 'parameter', 'value', 'num_trials', 'mae',
+                    'detection_rate']].to_string())
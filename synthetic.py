@@ -0,0 +1,65 @@
+"""
+Date: 17.10.2026
+Description: Generation of synthetic EMG recordings with MEPs of known onset, to test and benchmark the latency methods.
+"""
+import numpy as np
+
+import preprocessing as pp
+
+
+def generate_subject(num_trials=100, fs=5000, t_time=1, duration=2, noise_std=0.01, line_noise=0, line_freq=50,
+                     mep_amplitude=(0.2, 2), mep_duration=0.025, onset=(0.015, 0.03), p_no_mep=0, rng=None):
+    """Generate the EMG of one subject, with one MEP per trial after a trigger. Each MEP is a biphasic wave (random
+    polarity) starting smoothly at its onset.
+    :param num_trials: number of trials
+    :param fs: sampling frequency (Hz)
+    :param t_time: time of trigger (s)
+    :param duration: duration of each trial (s)
+    :param noise_std: standard deviation of the white gaussian noise (mV)
+    :param line_noise: amplitude of the line noise (mV)
+    :param line_freq: frequency of the line noise (Hz)
+    :param mep_amplitude: (min, max) peak-to-peak amplitude of the MEPs (mV), drawn uniformly for each trial
+    :param mep_duration: duration of the MEPs (s)
+    :param onset: (min, max) onset of the MEPs after the trigger (s), drawn uniformly for each trial
+    :param p_no_mep: probability of a trial without MEP
+    :param rng: np.random.Generator, or seed
+    :return epochs_emg: MxN array, M samples, N trials
+    :return onsets: array of N onsets, in samples from the beginning of the MEP window (10 ms after the trigger, as
+    the latencies computed in main.py), NaN for the trials without MEP
+    """
+    rng = np.random.default_rng(rng)
+    num_samples = int(duration * fs)
+    time = np.arange(num_samples) / fs
+    epochs_emg = rng.normal(0, noise_std, (num_samples, num_trials))
+    if line_noise:
+        phase = rng.uniform(0, 2 * np.pi, num_trials)
+        epochs_emg += line_noise * np.sin(2 * np.pi * line_freq * time[:, None] + phase)
+
+    # MEP waveform: one period of a sine under a squared-sine envelope, so that it starts with zero slope
+    mep_time = np.arange(int(mep_duration * fs)) / (mep_duration * fs)
+    waveform = np.sin(2 * np.pi * mep_time) * np.sin(np.pi * mep_time)**2
+    waveform /= np.ptp(waveform)
+
+    onset_samples = pp.epoch_samples(fs, t_time, onset[0], onset[1])
+    onsets = rng.integers(onset_samples[0], onset_samples[1], num_trials)
+    amplitudes = rng.uniform(mep_amplitude[0], mep_amplitude[1], num_trials) * rng.choice([-1, 1], num_trials)
+    has_mep = rng.random(num_trials) >= p_no_mep
+    idx_samples = onsets[has_mep] + np.arange(len(waveform))[:, None]
+    idx_trials = np.broadcast_to(np.flatnonzero(has_mep), idx_samples.shape)
+    mep_values = amplitudes[has_mep] * waveform[:, None]
+    in_trial = idx_samples < num_samples    # MEPs are cut at the end of the trial
+    epochs_emg[idx_samples[in_trial], idx_trials[in_trial]] += mep_values[in_trial]
+
+    mep_start, _ = pp.epoch_samples(fs, t_time, 0.01, 0.05)
+    onsets = np.where(has_mep, onsets - mep_start, np.nan)
+
+    return epochs_emg, onsets
+
+
+def generate_cohort(num_subjects=10, seed=0, **kwargs):
+    """Generate the EMG of several subjects (see generate_subject for kwargs)
+    :return: generator of (sub_id, epochs_emg, onsets) tuples"""
+    rng = np.random.default_rng(seed)
+    for idx_sub in range(num_subjects):
+        epochs_emg, onsets = generate_subject(rng=rng, **kwargs)
+        yield f'sub{idx_sub:04d}', epochs_emg, onsets
@@ -0,0 +1,42 @@
+import os
+import numpy as np
+
+from cache import ResultCache
+
+
+def test_evict_hashes(tmp_path):
+    recordings = [tmp_path / f'EMG_data_SP_{i}.npy' for i in range(3)]
+    for recording in recordings:
+        np.save(recording, np.zeros(10))
+    cache = ResultCache(str(tmp_path / 'cache'))
+    hashes = [cache.file_hash(str(recording)) for recording in recordings]
+    assert len(os.listdir(tmp_path / 'cache' / 'hashes')) == 3
+
+    # unchanged files are not hashed again, modified and deleted ones are evicted when the cache is opened again
+    np.save(recordings[1], np.ones(10))
+    os.remove(recordings[2])
+    cache = ResultCache(str(tmp_path / 'cache'))
+    assert len(os.listdir(tmp_path / 'cache' / 'hashes')) == 1
+    assert cache.file_hash(str(recordings[0])) == hashes[0]
+    assert cache.file_hash(str(recordings[1])) != hashes[1]
+
+
+def test_evict_only_above_max_size(tmp_path, monkeypatch):
+    cache = ResultCache(str(tmp_path / 'cache'), max_size_mb=1)
+    scans = []
+    evict = cache.evict
+    monkeypatch.setattr(cache, 'evict', lambda: scans.append(cache.size) or evict())
+    arrays = {'latencies': np.zeros(2**14)}   # 128 kB entries
+    for i in range(7):
+        cache.put(f'key{i}', arrays)
+    cache.put('key0', arrays)   # replaced, the size does not change
+    assert scans == [] and cache.size < 2**20
+    cache.put('key7', arrays)
+    cache.put('key8', arrays)
+    assert len(scans) == 2
+    assert cache.get('key8') is not None
+    entries = [entry for entry in os.listdir(tmp_path / 'cache') if entry.endswith('.npz')]
+    assert cache.size == sum(os.path.getsize(tmp_path / 'cache' / entry) for entry in entries) <= 2**20
+
+    # the size of the entries already in the cache is counted when it is opened
+    assert ResultCache(str(tmp_path / 'cache'), max_size_mb=1).size == cache.size
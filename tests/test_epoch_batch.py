@@ -0,0 +1,49 @@
+"""EpochBatch must return, for every trial, the latencies of the Epoch methods of the same name"""
+import numpy as np
+import pytest
+
+import preprocessing as pp
+from epoch_c import Epoch, EpochBatch
+
+FS = 5000
+METHODS = {'lat_bigoni': 'latency_bigoni_method', 'lat_hamada1': 'latency_method_hamada_1',
+           'lat_hamada2': 'latency_method_hamada_2', 'lat_garvey': 'latency_method_garvey_revised',
+           'lat_huang': 'latency_method_huang', 'lat_daskalakis': 'latency_method_daskalakis'}
+
+
+def gaussian(rng, num_trials):
+    emg = rng.normal(0, 0.02, (2 * FS, num_trials))
+    mep_start = int(1.02 * FS)
+    emg[mep_start:mep_start + 100] += rng.choice([-1, 1], num_trials) * np.sin(np.linspace(0, 2 * np.pi, 100))[:, None]
+    return emg
+
+
+def integers(rng, num_trials):
+    return rng.integers(-3, 4, (2 * FS, num_trials)).astype(float)
+
+
+def ties(rng, num_trials):
+    # integer MEPs and a 40 ms baseline shifted so that its mean is (up to round-off) a sample value of the MEP
+    emg = integers(rng, num_trials)
+    baseline = emg[int(0.96 * FS):int(0.998 * FS)]
+    baseline -= baseline.mean(axis=0) - rng.integers(-2, 3, num_trials)
+    return emg
+
+
+@pytest.mark.parametrize('signals', [gaussian, integers, ties])
+@pytest.mark.parametrize('seed', range(3))
+def test_batch_equals_single_trials(signals, seed):
+    rng = np.random.default_rng(seed)
+    emg = signals(rng, 40)
+    mep = pp.divide_in_epochs(emg, FS, 1, 0.01, 0.05)
+    baseline_signals = pp.divide_in_epochs(emg, FS, 1, -0.2, -0.02)
+
+    latencies = EpochBatch(mep.copy(), emg, FS, 1).latency_all_methods(baseline_signals)
+    for trial in range(emg.shape[1]):
+        # methods run in the order of latency_all_methods, as flips of the signal affect the next methods
+        epoch = Epoch(mep[:, trial].copy(), emg[:, trial], FS, 1)
+        for name, method in METHODS.items():
+            args = (baseline_signals,) if name == 'lat_hamada1' else ()
+            latency = getattr(epoch, method)(*args)
+            expected = np.nan if isinstance(latency, str) else latency
+            np.testing.assert_equal(latencies[name][trial], expected, err_msg=f'{name}, trial {trial}')
@@ -0,0 +1,64 @@
+import json
+import pandas as pd
+import pytest
+
+from results_writer import ResultWriter
+
+
+def results(sub_id, num_trials=3):
+    return pd.DataFrame({'sub_id': sub_id, 'trial': range(num_trials), 'lat_bigoni': 20.0})
+
+
+def test_csv_resume_after_crash(tmp_path):
+    path = str(tmp_path / 'latencies.csv')
+    with ResultWriter(path) as writer:
+        writer.append('s1', results('s1'))
+        writer.fail('s2', 'ValueError: broken')
+        writer.append('s3', results('s3'))
+    # crash while writing s4: its rows are in the output, but its checkpoint line is cut
+    with open(path, 'a') as f:
+        f.write('s4,0,20.0\ns4,1,')
+    with open(f'{path}.checkpoint', 'a') as f:
+        f.write('{"sub_id": "s4", "sta')
+
+    with ResultWriter(path, resume=True) as writer:
+        assert writer.finished() == {'s1', 's2', 's3'}
+        assert writer.finished(retry_failed=True) == {'s1', 's3'}
+        assert list(writer.read()['sub_id'].unique()) == ['s1', 's3']
+        writer.append('s2', results('s2'))
+        writer.append('s4', results('s4'))
+        assert not writer.failed
+    df = pd.read_csv(path, dtype={'sub_id': str})
+    assert list(df['sub_id'].unique()) == ['s1', 's3', 's2', 's4'] and len(df) == 12
+    with open(f'{path}.checkpoint') as f:
+        assert [json.loads(line)['sub_id'] for line in f] == ['s1', 's2', 's3', 's2', 's4']
+
+    # without resume, a new output is started
+    with ResultWriter(path) as writer:
+        assert not writer.finished() and writer.read().empty
+
+
+def test_csv_columns(tmp_path):
+    with ResultWriter(str(tmp_path / 'latencies.csv')) as writer:
+        writer.append('s1', results('s1'))
+        with pytest.raises(ValueError):
+            writer.append('s2', results('s2').drop(columns='lat_bigoni'))
+
+
+def test_parquet(tmp_path):
+    pytest.importorskip('pyarrow')
+    path = str(tmp_path / 'latencies.parquet')
+    with ResultWriter(path, flush_rows=5) as writer:
+        writer.append('s1', results('s1'))
+        writer.append('s2', results('s2'))     # 6 rows: written
+        writer.append('s3', results('s3'))     # buffered
+        assert len(writer.read()) == 9     # buffered rows are written before reading
+        writer.append('s4', results('s4'))
+    # a part written after the last checkpoint line (crash before recording it) is discarded
+    pd.concat([results('s5')]).to_parquet(tmp_path / 'latencies.parquet' / 'part-00099.parquet')
+
+    with ResultWriter(path, resume=True) as writer:
+        assert writer.finished() == {'s1', 's2', 's3', 's4'}
+        writer.append('s5', results('s5'))
+        df = writer.read()
+    assert sorted(df['sub_id'].unique()) == ['s1', 's2', 's3', 's4', 's5'] and len(df) == 15
@@ -0,0 +1,96 @@
+"""StreamingLatencyDetector must return the latencies of the Epoch methods, without allocating arrays"""
+import tracemalloc
+import numpy as np
+import pytest
+
+import preprocessing as pp
+from epoch_c import Epoch
+from streaming import StreamingLatencyDetector
+
+FS = 5000
+METHODS = ('latency_bigoni_method', 'latency_method_hamada_1', 'latency_method_hamada_2', 'latency_method_huang',
+           'latency_method_garvey_revised', 'latency_method_daskalakis')
+
+
+def stream(seed, num_trials=20):
+    """Continuous stream with a MEP after a trigger every 2 s
+    :return samples, triggers"""
+    rng = np.random.default_rng(seed)
+    samples = rng.normal(0, 0.02, 2 * FS * num_trials)
+    triggers = np.arange(num_trials) * 2 * FS + FS
+    for trigger in triggers:
+        mep = rng.choice([-1, 1]) * np.sin(np.linspace(0, 2 * np.pi, 100))
+        samples[trigger + 100:trigger + 200] += mep
+    return samples, triggers
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_stream_equals_epoch(seed):
+    samples, triggers = stream(seed)
+    baseline_signals = np.stack([samples[trigger - FS // 5:trigger - FS // 50] for trigger in triggers[:5]], axis=1)
+    detector = StreamingLatencyDetector(FS, METHODS, block_size=50, baseline_signals=baseline_signals)
+    results = []
+    for start in range(0, len(samples), 50):
+        for trigger in triggers[(triggers >= start) & (triggers < start + 50)]:
+            detector.trigger(trigger)
+        results += detector.push(samples[start:start + 50])
+
+    assert [result['trigger'] for result in results] == list(triggers)
+    for result, trigger in zip(results, triggers):
+        epoch_emg = samples[trigger - FS:trigger + FS]
+        epoch = Epoch(pp.divide_in_epochs(epoch_emg, FS, 1, 0.01, 0.05).copy(), epoch_emg, FS, 1)
+        assert result['ptp'] == epoch.ptp
+        for method in METHODS:
+            latency = getattr(epoch, method)(*((baseline_signals,) if method == 'latency_method_hamada_1' else ()))
+            np.testing.assert_equal(result[method], np.nan if isinstance(latency, str) else latency, err_msg=method)
+
+
+def test_late_trigger():
+    # the trigger at 5000 is registered when its window [4000, 5250) is complete and the oldest sample in the ring is
+    # 3950: it is detected at once, before the next push overwrites its baseline
+    samples, _ = stream(0, num_trials=3)
+    detector = StreamingLatencyDetector(FS, METHODS[:1], block_size=200)
+    assert len(detector.ring) == 1450
+    detector.push(samples[:5400])
+    result = detector.trigger(5000)
+    np.testing.assert_array_equal(detector.window, samples[4000:5250])
+    assert detector.push(samples[5400:5600]) == []
+
+    reference = StreamingLatencyDetector(FS, METHODS[:1], block_size=200)
+    reference.trigger(5000)
+    assert reference.push(samples[:5400]) == [result]
+
+    with pytest.raises(ValueError):
+        detector.trigger(5000 - 200)    # baseline no longer in the ring
+
+
+@pytest.mark.parametrize('t_max', [0.05, 0.5])
+def test_no_allocation(t_max):
+    samples, triggers = stream(0)
+    detector = StreamingLatencyDetector(FS, METHODS, t_max=t_max, block_size=50, baseline_signals=np.zeros((10, 5)))
+    tracemalloc.start()
+    try:
+        # numpy keeps the small buffers it frees in a cache, which fills up during the first passes over the stream
+        for offset in range(0, 5 * len(samples), len(samples)):
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            for start in range(0, len(samples), 50):
+                for trigger in triggers[(triggers >= start) & (triggers < start + 50)]:
+                    detector.trigger(offset + trigger)
+                detector.push(samples[start:start + 50])
+        peak = tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+    # a few kB of results and numpy bookkeeping, whatever the size of the window (its MEP part alone is 18 kB for
+    # t_max=0.5)
+    assert peak < 4096
+
+
+def test_triggers_out_of_order():
+    samples, _ = stream(0, num_trials=3)
+    detector = StreamingLatencyDetector(FS, METHODS[:1], block_size=200)
+    detector.push(samples[:4000])
+    detector.trigger(7000)
+    with pytest.raises(ValueError):
+        detector.trigger(5000)  # would only be detected after the trigger at 7000, once its baseline is overwritten
+    assert [result['trigger'] for result in detector.push(samples[4000:])] == [7000]
@@ -0,0 +1,33 @@
+"""With the default grid, the sweep must return the latencies of EpochBatch on the trials kept by the rejection"""
+import numpy as np
+import pytest
+
+import preprocessing as pp
+import sweep
+from epoch_c import EpochBatch
+
+FS = 5000
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_default_grid_equals_epoch_batch(seed):
+    rng = np.random.default_rng(seed)
+    emg = rng.normal(0, 0.02, (2 * FS, 40))
+    mep_start = int(1.02 * FS)
+    emg[mep_start:mep_start + 100] += rng.choice([-1, 1], 40) * np.sin(np.linspace(0, 2 * np.pi, 100))[:, None]
+    emg[:, :5] = rng.normal(0, 0.02, (2 * FS, 5))     # trials without MEP, rejected
+
+    results = sweep.sweep_subject(emg, FS, np.zeros(emg.shape[1]))
+    mep = pp.divide_in_epochs(emg, FS, 1, *sweep.MEP_WINDOW)
+    baseline = pp.divide_in_epochs(emg, FS, 1, *sweep.BASELINE_WINDOW)
+    keep = pp.reject_trials(mep, baseline)[0]
+    assert 0 < keep.sum() < len(keep)
+    expected = EpochBatch(mep.copy(), emg, FS, 1, keep=keep).latency_all_methods()
+
+    grid = sweep.DEFAULT_GRID
+    for method, window in sweep.METHOD_WINDOWS.items():
+        key = (grid['mep_window'][0], grid['baseline_window'][0], grid['thr_corr'][0], grid['ptp_percentile'][0],
+               method, grid[window][0] if window else None)
+        latencies, gt = results[key]
+        assert latencies.shape == (keep.sum(), 1)
+        np.testing.assert_equal(latencies[:, 0], expected[method][keep], err_msg=method)
@@ -0,0 +1,49 @@
+import numpy as np
+
+import preprocessing as pp
+import triggers
+
+FS = 5000
+WINDOWS = [(0.01, 0.05), (-0.2, -0.002)]
+
+
+def test_recording_windows_equal_epoch_windows(tmp_path):
+    # continuous recording with a TMS artifact every 3 s, and the file of its epochs (trigger at 1 s)
+    rng = np.random.default_rng(0)
+    recording = rng.normal(0, 0.01, 30 * FS)
+    onsets = np.arange(2, 29, 3) * FS
+    for onset in onsets:
+        recording[onset:onset + 5] += [5, -4, 3, -2, 1]
+    np.save(tmp_path / 'continuous.npy', recording)
+    np.save(tmp_path / 'epochs.npy', np.stack([recording[onset - FS:onset + FS] for onset in onsets], axis=1))
+
+    # same pad, within the epochs, so that the same samples are filtered
+    sos = pp.filter_design(FS, (20, 1000), (50,))
+    for filtering in (None, sos):
+        epochs, sample_offset = triggers.load_recording_windows(str(tmp_path / 'continuous.npy'), FS, WINDOWS,
+                                                                sos=filtering, pad=0.5)
+        expected, expected_offset = pp.load_epochs_windows(str(tmp_path / 'epochs.npy'), FS, WINDOWS, sos=filtering,
+                                                           pad=0.5)
+        assert sample_offset == expected_offset
+        np.testing.assert_array_equal(epochs, expected)
+
+
+def test_filtered_windows_near_the_ends():
+    # the pad of the filter is clamped to the recording, so the triggers close to its ends are kept when filtering
+    recording = np.random.default_rng(1).normal(0, 0.01, 10 * FS)
+    sos = pp.filter_design(FS, notch=(50,))
+    pad = pp.filter_decay_samples(sos)
+    trigger_list = [FS // 4, 5 * FS, 10 * FS - FS // 10]
+    assert pad > FS // 4
+    _, _, unfiltered = triggers.load_trigger_windows(recording, FS, trigger_list, WINDOWS)
+    epochs, sample_offset, kept = triggers.load_trigger_windows(recording, FS, trigger_list, WINDOWS, sos=sos,
+                                                                chunk_size=2)
+    np.testing.assert_array_equal(kept, trigger_list)
+    np.testing.assert_array_equal(unfiltered, trigger_list)
+
+    # each trial filtered with the signal available around it
+    for trial, trigger in enumerate(trigger_list):
+        first = trigger - FS + sample_offset
+        start, stop = max(0, first - pad), min(len(recording), first + len(epochs) + pad)
+        expected = pp.filter_epochs(recording[start:stop], sos)[first - start:first - start + len(epochs)]
+        np.testing.assert_allclose(epochs[:, trial], expected, rtol=0, atol=1e-15)
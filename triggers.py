@@ -0,0 +1,220 @@
+"""
+Date: 17.10.2026
+Description: Detection of the TMS triggers in continuous recordings and epoching around them, so that continuous
+recordings can be processed as the EMG_data_SP.npy files of pre-cut epochs (trigger at t_time in each epoch). The
+recording is memory-mapped and scanned by chunks overlapping by one sample, so that edges between chunks are not missed:
+a trigger is the rising edge of a trigger channel, or the onset of the TMS artifact in the EMG (first difference of the
+EMG larger than artifact_k times its robust SD in the chunk). main.py --continuous reads only the samples of the
+epoch windows around the triggers, without saving the epochs (see load_recording_windows).
+"""
+import argparse
+import os
+import numpy as np
+
+import preprocessing as pp
+
+CHUNK_DURATION = 60     # seconds of recording scanned at once
+
+
+def detect_triggers(recording, fs, channel=None, trigger_channel=None, threshold=None, artifact_k=30, refractory=0.5,
+                    chunk_duration=CHUNK_DURATION):
+    """Sample indices of the TMS triggers in a continuous recording
+    :param recording: array of M samples (or MxC, C channels), e.g. a .npy file memory-mapped with np.load(path,
+    mmap_mode='r')
+    :param fs: sampling frequency (Hz)
+    :param channel: channel of MxC recordings searched for the TMS artifacts
+    :param trigger_channel: channel of MxC recordings with the trigger pulses. If given, the triggers are its rising
+    edges instead of the artifacts
+    :param threshold: level crossed by the trigger pulses, or by the absolute first difference of the EMG at the
+    artifacts. Default: midpoint between the minimum and maximum of the trigger channel, or artifact_k times the robust
+    SD of the first difference of the EMG in each chunk
+    :param artifact_k: number of robust SD of the first difference of the EMG above which a sample is an artifact
+    :param refractory: minimal time between two triggers (s): crossings closer than refractory to the previous
+    crossing (e.g., the ringing of the artifact) are part of the same trigger
+    :param chunk_duration: seconds of recording read at once
+    :return triggers: array of sample indices (first sample above threshold)
+    """
+    column = trigger_channel if trigger_channel is not None else channel
+    if recording.ndim > 1:
+        if column is None:
+            raise ValueError('channel or trigger_channel is needed for recordings with several channels')
+        recording = recording[:, column]
+    if threshold is None and trigger_channel is not None:
+        threshold = _midpoint(recording, int(chunk_duration * fs))
+
+    chunk_size = int(chunk_duration * fs)
+    crossings = []
+    for start in range(0, max(len(recording) - 1, 0), chunk_size):
+        # one sample of overlap with the next chunk
+        chunk = np.asarray(recording[start:start + chunk_size + 1], dtype=float)
+        if trigger_channel is not None:
+            above = chunk >= threshold
+            crossed = above[1:] & ~above[:-1]
+        else:
+            diff = abs(np.diff(chunk))
+            thr = threshold
+            if thr is None:
+                thr = artifact_k * np.median(abs(diff - np.median(diff))) / 0.6745
+            crossed = diff > thr
+        crossings.append(np.flatnonzero(crossed) + start + 1)
+    crossings = np.concatenate(crossings) if crossings else np.array([], dtype=int)
+
+    # first crossing of each group of crossings separated by less than refractory
+    first = np.diff(crossings, prepend=-np.inf) > refractory * fs
+
+    return crossings[first]
+
+
+def load_trigger_windows(recording, fs, triggers, windows, t_time=1, channel=None, dtype=None, sos=None, pad=None,
+                         chunk_size=256):
+    """Epochs of a continuous recording around the triggers, covering only the samples needed by the given epoch
+    windows (as load_epochs_windows does for pre-cut epochs). Triggers whose windows are not all within the recording
+    are left out. If a filter is given, pad seconds of signal are also read before and after the windows (less for the
+    triggers close to the ends of the recording), to absorb the transients of the filter, and trials are read and
+    filtered by chunks.
+    :param recording: array of M samples (or MxC, C channels), e.g. memory-mapped
+    :param fs: sampling frequency (Hz)
+    :param triggers: sample indices of the triggers (see detect_triggers)
+    :param windows: list of (t_min, t_max) tuples, as passed to divide_in_epochs
+    :param t_time: time of trigger in the epochs
+    :param channel: channel (or list of channels) of MxC recordings, None for all
+    :param dtype: dtype of the returned epochs (default: the one of the recording)
+    :param sos: second-order sections of a zero-phase filter applied to the epochs (see pp.filter_design), None for no
+    filtering
+    :param pad: seconds of signal read before and after the windows when filtering. Default: the time for the impulse
+    response of the filter to decay to 1e-3 (see pp.filter_decay_samples), within the recording
+    :param chunk_size: number of trials filtered together
+    :return epochs: KxN (or KxNxC) array, K samples spanning all windows, N trials
+    :return sample_offset: index in the epochs (with the trigger at t_time) of the first sample of epochs, to pass to
+    divide_in_epochs
+    :return triggers: the triggers of the N trials
+    """
+    idx, samp_start, triggers = _trigger_indices(fs, triggers, windows, t_time, len(recording))
+    if sos is None:
+        epochs = np.asarray(_read(recording, idx.ravel(), channel), dtype=dtype)
+        return epochs.reshape(idx.shape + epochs.shape[1:]), samp_start, triggers
+
+    if dtype is None:
+        dtype = recording.dtype if np.issubdtype(recording.dtype, np.floating) else float
+    num_samples = idx.shape[0]
+    pad_samples = pp.filter_decay_samples(sos) if pad is None else int(pad * fs)
+    # pads before and after each epoch, within the recording
+    pads = np.column_stack([np.minimum(pad_samples, idx[0]), np.minimum(pad_samples, len(recording) - 1 - idx[-1])])
+    epochs = np.empty(idx.shape + _read(recording, [0], channel).shape[1:], dtype=dtype)
+    # trials with the same pads (all but the ones close to the ends of the recording) are filtered together
+    for pad_before, pad_after in np.unique(pads, axis=0):
+        group = np.flatnonzero((pads[:, 0] == pad_before) & (pads[:, 1] == pad_after))
+        for start in range(0, len(group), chunk_size):
+            trials = group[start:start + chunk_size]
+            padded = idx[0, trials] + np.arange(-pad_before, num_samples + pad_after)[:, None]
+            chunk = np.asarray(_read(recording, padded.ravel(), channel), dtype=float)
+            filtered = pp.filter_epochs(chunk.reshape(padded.shape + chunk.shape[1:]), sos)
+            epochs[:, trials] = filtered[pad_before:pad_before + num_samples]
+
+    return epochs, samp_start, triggers
+
+
+def load_recording_windows(path, fs, windows, t_time=1, channel=None, dtype=None, sos=None, pad=None, **detection):
+    """Detect the triggers of a continuous recording and load the samples of the epochs around them needed by the
+    given windows, as load_epochs_windows does for a file of pre-cut epochs (see load_trigger_windows)
+    :param path: path to the .npy file of the continuous recording (M samples, or MxC)
+    :param channel: EMG channel (or list of channels) of MxC recordings, also searched for the artifacts (first channel
+    of the list) unless a trigger_channel is given
+    :param detection: other parameters of detect_triggers (e.g., trigger_channel, threshold)
+    :return epochs: KxN (or KxNxC) array, K samples spanning all windows, N trials
+    :return sample_offset: index in the epochs (with the trigger at t_time) of the first sample of epochs
+    """
+    recording = np.load(path, mmap_mode='r')
+    detection_channel = channel[0] if isinstance(channel, (list, tuple)) else channel
+    triggers = detect_triggers(recording, fs, channel=detection_channel, **detection)
+    epochs, sample_offset, _ = load_trigger_windows(recording, fs, triggers, windows, t_time, channel, dtype, sos, pad)
+
+    return epochs, sample_offset
+
+
+def epoch_recording(path, out_path, fs, t_min=-1, t_max=1, channel=None, chunk_size=256, **detection):
+    """Detect the triggers of a continuous recording and save its epochs as a EMG_data_SP.npy file (MxN array, or MxNxC
+    if channel is a list, with the trigger at -t_min), written by chunks of trials
+    :param path: path to the .npy file of the continuous recording (M samples, or MxC)
+    :param out_path: path to the .npy file of the epochs
+    :param fs: sampling frequency (Hz)
+    :param t_min: start of the epochs, related to the trigger (s)
+    :param t_max: end of the epochs, related to the trigger (s)
+    :param channel: EMG channel (or list of channels) of MxC recordings, also searched for the artifacts (first channel
+    of the list) unless a trigger_channel is given
+    :param chunk_size: number of trials written at once
+    :param detection: other parameters of detect_triggers (e.g., trigger_channel, threshold)
+    :return triggers: sample indices of the triggers of the saved trials
+    """
+    recording = np.load(path, mmap_mode='r')
+    detection_channel = channel[0] if isinstance(channel, (list, tuple)) else channel
+    triggers = detect_triggers(recording, fs, channel=detection_channel, **detection)
+    idx, _, triggers = _trigger_indices(fs, triggers, [(t_min, t_max)], -t_min, len(recording))
+
+    channel_shape = _read(recording, [0], channel).shape[1:]
+    epochs = np.lib.format.open_memmap(out_path, mode='w+', dtype=recording.dtype, shape=idx.shape + channel_shape)
+    for start in range(0, len(triggers), chunk_size):
+        trials = slice(start, start + chunk_size)
+        epochs[:, trials] = _read(recording, idx[:, trials].ravel(), channel).reshape(idx[:, trials].shape +
+                                                                                      channel_shape)
+    epochs.flush()
+
+    return triggers
+
+
+def _trigger_indices(fs, triggers, windows, t_time, num_samples):
+    """Indices in the recording of the samples of the epochs spanning the windows, for the triggers whose epochs are
+    within the recording
+    :return idx: KxN array of indices, K samples, N trials
+    :return samp_start: index in the epochs (with the trigger at t_time) of the first sample
+    :return triggers: the triggers of the N trials"""
+    samples = [pp.epoch_samples(fs, t_time, t_min, t_max) for t_min, t_max in windows]
+    samp_start = min(samp_t_min for samp_t_min, _ in samples)
+    samp_stop = max(samp_t_max for _, samp_t_max in samples)
+    trigger_sample = pp.epoch_samples(fs, t_time, 0, 0)[0]
+
+    triggers = np.asarray(triggers, dtype=int)
+    triggers = triggers[(triggers + samp_start - trigger_sample >= 0) &
+                        (triggers + samp_stop - trigger_sample <= num_samples)]
+    idx = triggers[None, :] + (np.arange(samp_start, samp_stop) - trigger_sample)[:, None]
+
+    return idx, samp_start, triggers
+
+
+def _read(recording, samples, channel=None):
+    """Samples of a (memory-mapped) recording, in a channel (or list of channels) of MxC recordings. Samples are
+    selected first, so that only them are read"""
+    samples = recording[samples]
+
+    return samples[:, channel] if recording.ndim > 1 and channel is not None else samples
+
+
+def _midpoint(recording, chunk_size):
+    """Midpoint between the minimum and maximum of a (memory-mapped) 1-D recording, read by chunks"""
+    low, high = np.inf, -np.inf
+    for start in range(0, len(recording), chunk_size):
+        chunk = np.asarray(recording[start:start + chunk_size])
+        low, high = min(low, chunk.min()), max(high, chunk.max())
+
+    return (low + high) / 2
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Epoch a continuous recording around the TMS triggers, saving a '
+                                                 'EMG_data_SP.npy file for main.py')
+    parser.add_argument('recording', help='.npy file of the continuous recording (samples, or samples x channels)')
+    parser.add_argument('out_dir', help='folder of the subject, where EMG_data_SP.npy and triggers.npy are saved')
+    parser.add_argument('--fs', type=int, default=5000, help='sampling frequency (Hz)')
+    parser.add_argument('--channel', type=int, nargs='+', help='EMG channel(s), searched for the artifacts')
+    parser.add_argument('--trigger-channel', type=int, help='channel with the trigger pulses')
+    parser.add_argument('--threshold', type=float, help='threshold of the trigger channel or of the artifacts')
+    parser.add_argument('--refractory', type=float, default=0.5, help='minimal time between triggers (s)')
+    args = parser.parse_args()
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    channel = args.channel[0] if args.channel and len(args.channel) == 1 else args.channel
+    triggers = epoch_recording(args.recording, os.path.join(args.out_dir, 'EMG_data_SP.npy'), args.fs,
+                               channel=channel, trigger_channel=args.trigger_channel, threshold=args.threshold,
+                               refractory=args.refractory)
+    np.save(os.path.join(args.out_dir, 'triggers.npy'), triggers)
+    print(f'{len(triggers)} triggers saved in {args.out_dir}')